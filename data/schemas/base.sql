@@ -12,6 +12,8 @@ create table if not exists discord_servers(
 alter table discord_servers add column if not exists servername text;
 alter table discord_servers add column if not exists language text;
 alter table discord_servers add column if not exists play_maxlen integer default 0;
+-- how many sounds /play queues behind the current one, 0 replaces the current sound
+alter table discord_servers add column if not exists play_queue integer default 0;
 
 -- discord_user_displaynames
 create table if not exists discord_user_displaynames(
@@ -47,6 +49,10 @@ create table if not exists files(
 alter table files add column if not exists seconds bigint;
 alter table files add column if not exists deleted boolean default false not null;
 alter table files add column if not exists deletion_date timestamp;
+-- EBU R128 measurements: integrated loudness (LUFS), true peak (dBTP), loudness range (LU)
+alter table files add column if not exists loudness real;
+alter table files add column if not exists true_peak real;
+alter table files add column if not exists loudness_range real;
 
 -- tags
 create table if not exists tags(
@@ -62,3 +68,40 @@ create table if not exists files_tags(
     foreign key (tag_id) references tags,
     primary key (file_id,tag_id)
 );
+
+-- indexes
+create index if not exists files_file_hash_idx on files (file_hash);
+create index if not exists files_file_name_idx on files (file_name);
+create index if not exists files_visible_display_name_idx on files (display_name, file_id) where not deleted;
+-- name lookups only care about visible files, which the partial index above covers
+drop index if exists files_display_name_idx;
+create index if not exists files_deleted_idx on files (file_id) where deleted;
+create index if not exists files_tags_tag_id_idx on files_tags (tag_id, file_id);
+create index if not exists tags_tag_name_lower_idx on tags (lower(tag_name));
+
+-- change notifications, keep the in-memory sound catalog up-to-date
+create or replace function notify_files_changed() returns trigger as $$
+begin
+    perform pg_notify('files_changed', coalesce(new.file_id, old.file_id)::text);
+    return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists files_changed on files;
+create trigger files_changed after insert or update or delete on files
+    for each row execute function notify_files_changed();
+
+drop trigger if exists files_tags_changed on files_tags;
+create trigger files_tags_changed after insert or update or delete on files_tags
+    for each row execute function notify_files_changed();
+
+create or replace function notify_servers_changed() returns trigger as $$
+begin
+    perform pg_notify('servers_changed', coalesce(new.server_id, old.server_id)::text);
+    return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists servers_changed on discord_servers;
+create trigger servers_changed after insert or update or delete on discord_servers
+    for each row execute function notify_servers_changed();
@@ -21,3 +21,15 @@ ALTER TABLE brotato_runs ADD COLUMN IF NOT EXISTS char_id SMALLINT NOT NULL;
 ALTER TABLE brotato_runs ADD COLUMN IF NOT EXISTS wave SMALLINT NOT NULL;
 ALTER TABLE brotato_runs ADD COLUMN IF NOT EXISTS danger SMALLINT NOT NULL;
 ALTER TABLE brotato_runs ADD COLUMN IF NOT EXISTS timestamp INTEGER;
+
+-- indexes, each highscore query can be answered from one of the brotato_runs indexes
+CREATE INDEX IF NOT EXISTS brotato_chars_name_de_lower_idx ON brotato_chars (LOWER(name_de));
+CREATE INDEX IF NOT EXISTS brotato_chars_name_en_lower_idx ON brotato_chars (LOWER(name_en));
+CREATE INDEX IF NOT EXISTS brotato_runs_server_wave_idx
+    ON brotato_runs (server_id, wave DESC) INCLUDE (user_id, danger, char_id);
+CREATE INDEX IF NOT EXISTS brotato_runs_server_char_wave_idx
+    ON brotato_runs (server_id, char_id, wave DESC) INCLUDE (user_id, danger);
+CREATE INDEX IF NOT EXISTS brotato_runs_server_danger_wave_idx
+    ON brotato_runs (server_id, danger, wave DESC) INCLUDE (user_id, char_id);
+CREATE INDEX IF NOT EXISTS brotato_runs_server_danger_char_wave_idx
+    ON brotato_runs (server_id, danger, char_id, wave DESC) INCLUDE (user_id);
@@ -1,9 +1,65 @@
-from gustelbot import gustelbot
+# default
+import argparse
+import logging
+import pathlib
+import shutil
+# pip
+# internal
 
 
 def main():
+    parser = argparse.ArgumentParser(prog="gustelbot", description="Starts GustelBot, or runs one of its commands.")
+    commands = parser.add_subparsers(dest="command")
+    importer = commands.add_parser("import", help="import a folder of sounds without uploading them through Discord")
+    importer.add_argument("folder", type=pathlib.Path, help="folder which is searched for sounds recursively")
+    importer.add_argument("--server", type=int, help="server the sounds belong to, global if omitted")
+    importer.add_argument("--uploader", type=int, help="user id stored as uploader, must be known to the bot")
+    importer.add_argument("--tag", action="append", default=[], help="tag added to every sound, can be repeated")
+    importer.add_argument(
+        "--no-folder-tags", action="store_true", help="don't tag sounds with the names of their sub-folders"
+    )
+    importer.add_argument(
+        "--normalize", action="store_true", help="measure and transcode the sounds with ffmpeg while importing"
+    )
+    importer.add_argument("--workers", type=int, help="parallel processes, defaults to the cpu count")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        if not args.folder.is_dir():
+            parser.error(f"{args.folder} is not a folder")
+        if args.normalize and shutil.which("ffmpeg") is None:
+            parser.error("--normalize requires ffmpeg")
+        from gustelbot.util.importer import ImporterError
+        try:
+            import_sounds(args)
+        except ImporterError as e:
+            parser.error(str(e))
+        return
+
+    # imported here, gustelbot.gustelbot connects to the database on import and worker processes re-import this file
+    from gustelbot import gustelbot
     gustelbot.start()
 
 
+def import_sounds(args: argparse.Namespace):
+    from gustelbot.util import config
+    from gustelbot.util.importer import Importer
+
+    settings = config.Config()
+    logging.basicConfig(encoding='utf-8', level=settings.get_loglevel())
+    importer = Importer(
+        settings.folders["sounds_custom"],
+        settings.folders["sounds_opus"],
+        server_id=args.server,
+        uploader_id=args.uploader,
+        tags=tuple(args.tag),
+        folder_tags=not args.no_folder_tags,
+        normalize=args.normalize,
+        workers=args.workers
+    )
+    count = importer.run(args.folder)
+    logging.info(f"Imported {count} sounds.")
+
+
 if __name__ == '__main__':
     main()
@@ -5,9 +5,7 @@ import discord
 from discord.ext import commands
 # internal
 from gustelbot.util import config
-from gustelbot.util.database import Brotato as BrotatoCon
-from gustelbot.util.database import Database
-from gustelbot.util.database import User
+from gustelbot.util.engine import UnitOfWork
 
 
 class Brotato(commands.Cog):
@@ -37,10 +35,9 @@ class Brotato(commands.Cog):
             difficulty: _description_. Defaults to 0, max_value=5, required=False).
             character: _description_. Defaults to False).
         """
-        self.__ensure_server(ctx)
-        db_con = Database.new_connection()
-
-        result = BrotatoCon.get_brotato_highscore(db_con, difficulty, character, ctx.guild.id)
+        db = self.bot.db.unit_of_work(ctx)
+        await self.__ensure_server(db, ctx)
+        result = await db.brotato.get_brotato_highscore(difficulty, character, ctx.guild.id)
         result_table = self.__format_table(result[0], result[1])
 
         if result_table is None:
@@ -74,30 +71,30 @@ class Brotato(commands.Cog):
         if user is None:
             user = ctx.author
 
-        self.__ensure_server(ctx)
-        self.__ensure_user(ctx, user)
-        db_con = Database.new_connection()
+        db = self.bot.db.unit_of_work(ctx)
+        await self.__ensure_server(db, ctx)
+        await self.bot.known_users.ensure(user.id, user.name, ctx.guild.id, user.display_name)
 
-        chars = [str(x["name_de"]).lower() for x in BrotatoCon.get_brotato_char(db_con)]
+        chars = [str(x["name_de"]).lower() for x in await db.brotato.get_brotato_char() or []]
 
         if str(char).lower() not in chars:
             await ctx.respond(f"'{char}' is an unknown character")
             return
 
-        BrotatoCon.add_brotato_run(db_con, char, wave, danger, user.id, ctx.guild.id)
-        db_con.commit()
+        await db.brotato.add_brotato_run(char, wave, danger, user.id, ctx.guild.id)
+        await db.commit()
         await ctx.respond(f"**Run hinzugefügt:**\nCharakter: `{char}`, Welle: `{wave}`, Gefahr: `{danger}`")
 
     @brotato_add.command(name="char", description="add character")
     @discord.option(name="char", description="Character to add")
     async def add_char(self, ctx: discord.ApplicationContext, char: str):
-        db_con = Database.new_connection()
+        db = self.bot.db.unit_of_work(ctx)
 
-        db_char = Brotato.get_brotato_char(db_con, char)
+        db_char = await db.brotato.get_brotato_char(char)
         if db_char is None:
-            Brotato.add_brotato_char(db_con, char)
+            await db.brotato.add_brotato_char(char)
+            await db.commit()
             await ctx.respond(f"Added new char '{char}'")
-            db_con.commit()
         else:
             await ctx.respond(f"Character '{char}' already exists.")
 
@@ -106,28 +103,17 @@ class Brotato(commands.Cog):
 
     # helper functions
     @staticmethod
-    def __ensure_server(ctx: discord.ApplicationContext):
+    async def __ensure_server(db: UnitOfWork, ctx: discord.ApplicationContext):
         """Makes sure the context server is part of the database
         Args:
+            db: database connection
             ctx: command context
         """
-        db_con = Database.new_connection()
         if ctx.guild is None:
             return
-        Database.add_server(db_con, ctx.guild.id, ctx.guild.name)
-        db_con.commit()
-
-    @staticmethod
-    def __ensure_user(ctx: discord.ApplicationContext, user: discord.Member):
-        """Makes sure mentioned user is part of the database
-        Args:
-            ctx: _description_
-            user: _description_
-        """
-        db_con = Database.new_connection()
-        User.add_user(db_con, user.id, user.name)
-        User.add_user_display_name(db_con, user.id, ctx.guild.id, user.display_name)
-        db_con.commit()
+        await db.database.add_server(ctx.guild.id, ctx.guild.name)
+        # committed right away, display names referencing the server are written in their own transaction
+        await db.commit()
 
     @staticmethod
     def __format_table(lst: list[tuple], header: list) -> str:
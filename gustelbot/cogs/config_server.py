@@ -6,7 +6,6 @@ import discord
 from discord.ext import commands
 # internal
 from gustelbot.util import config
-from gustelbot.util import database
 
 
 class ConfigServer(commands.Cog):
@@ -29,13 +28,13 @@ class ConfigServer(commands.Cog):
         """
         Adds a new group to allowed bot admins within this server
         """
-        db_con = database.Database()
-
         if not ConfigServer.__is_allowed(ctx):
             await ConfigServer.__permission_error(ctx)
             return
         try:
-            result_code = db_con.add_admin_group(ctx.guild.id, group.name)
+            db = self.bot.db.unit_of_work(ctx)
+            result_code = await db.database.add_admin_group(ctx.guild.id, group.name)
+            await db.commit()
         except Exception:
             logging.error(f"Failed to add admin group: {traceback.format_exc()}")
             await ctx.respond("Internal Server Error")
@@ -52,13 +51,13 @@ class ConfigServer(commands.Cog):
         """
         Removes a group grom local server admins
         """
-        db_con = database.Database()
-
         if not ConfigServer.__is_allowed(ctx):
             await ConfigServer.__permission_error(ctx)
             return
         try:
-            result_code = db_con.remove_admin_group(ctx.guild.id, group.name)
+            db = self.bot.db.unit_of_work(ctx)
+            result_code = await db.database.remove_admin_group(ctx.guild.id, group.name)
+            await db.commit()
         except Exception:
             logging.error(f"Failed to remove admin group: {traceback.format_exc()}")
             await ctx.respond("Internal Server Error")
@@ -72,7 +71,11 @@ class ConfigServer(commands.Cog):
     config_play = config.create_subgroup("play", "configure behaviour of play command")
 
     @config_play.command(name="maxlength", description="change maximum length when playing random sound.")
-    @discord.option(name="seconds", min=0, max=1800, description="Maximum seconds allowed. Zero == unlimited")
+    @discord.option(
+        name="seconds",
+        min_value=0, max_value=1800,
+        description="Maximum seconds allowed. Zero == unlimited"
+    )
     async def play_maxlength(
         self, ctx: discord.ApplicationContext,
         seconds: int
@@ -80,12 +83,13 @@ class ConfigServer(commands.Cog):
         """
         Sets maximum length of the song played when searching for random sound
         """
-        db_con = database.Database()
         if not ConfigServer.__is_allowed(ctx):
             await ConfigServer.__permission_error(ctx)
             return
         try:
-            db_con.set_play_maxlen(ctx.guild.id, seconds)
+            db = self.bot.db.unit_of_work(ctx)
+            await db.database.set_play_max_len(ctx.guild.id, seconds)
+            await db.commit()
         except Exception:
             logging.error(f"Failed to set maxlength: {traceback.format_exc()}")
             await ctx.respond("Internal Server Error")
@@ -93,6 +97,36 @@ class ConfigServer(commands.Cog):
         await ctx.respond(f"Max length of randomly chosen tracks set to {seconds} seconds.")
         return
 
+    @config_play.command(name="queue", description="queue sounds instead of replacing the playing one.")
+    @discord.option(
+        name="depth",
+        min_value=0, max_value=20,
+        description="Sounds waiting behind the playing one. Zero == no queue"
+    )
+    async def play_queue(
+        self, ctx: discord.ApplicationContext,
+        depth: int
+    ):
+        """
+        Sets how many sounds /play queues while another one is playing
+        """
+        if not ConfigServer.__is_allowed(ctx):
+            await ConfigServer.__permission_error(ctx)
+            return
+        try:
+            db = self.bot.db.unit_of_work(ctx)
+            await db.database.set_play_queue(ctx.guild.id, depth)
+            await db.commit()
+        except Exception:
+            logging.error(f"Failed to set queue depth: {traceback.format_exc()}")
+            await ctx.respond("Internal Server Error")
+            return
+        if depth:
+            await ctx.respond(f"Up to {depth} sounds are queued behind the playing one.")
+        else:
+            await ctx.respond("Sounds replace the playing one.")
+        return
+
     config_upload = config.create_subgroup("upload", "Configure upload command")
 
     @config_upload.command(name="setuploader", description="Allow user to upload audio-files to GustelBot")
@@ -102,9 +136,10 @@ class ConfigServer(commands.Cog):
         if not await ctx.bot.is_owner(ctx.author):
             await ConfigServer.__permission_error(ctx, 'global')
             return
-        db_con = database.Database().new_connection()
         try:
-            database.User.user_set_uploader(db_con, user, uploader)
+            db = self.bot.db.unit_of_work(ctx)
+            await db.user.user_set_uploader(user, uploader)
+            await db.commit()
         except Exception as e:
             await ctx.respond("Error: Failed to set user")
             logging.error(e)
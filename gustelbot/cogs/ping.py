@@ -5,6 +5,7 @@ import discord
 from discord.ext import commands
 # internal
 from gustelbot.util import config
+from gustelbot.util import voice
 
 
 class Ping(commands.Cog):
@@ -15,4 +16,10 @@ class Ping(commands.Cog):
 
     @discord.slash_command(name="ping", description="Replies with bot's latency.")
     async def ping(self, ctx: discord.ApplicationContext):
-        await ctx.respond(f"Latency: {int(self.bot.latency * 1000)}ms")
+        message = f"Latency: {int(self.bot.latency * 1000)}ms"
+        if (joins := voice.join_statistics()) is not None:
+            message += (
+                f"\nTime to first sound after joining: {int(joins['median'])}ms median, "
+                f"{int(joins['max'])}ms max (last {joins['count']} joins)"
+            )
+        await ctx.respond(message)
@@ -1,6 +1,7 @@
 """
 This file implements all commands regarding sounds.
 """
+import asyncio
 import logging
 import math
 import pathlib
@@ -10,100 +11,147 @@ import tempfile
 import traceback
 import typing
 from datetime import timedelta
-from difflib import SequenceMatcher
 
 import discord
 from discord.ext import commands
 from discord.ext import tasks
-from psycopg2.extensions import connection
 
 from gustelbot.util import config
 from gustelbot.util import dataclasses
-from gustelbot.util import filemgr
+from gustelbot.util import loudness
+from gustelbot.util import storage
+from gustelbot.util import transcode
+from gustelbot.util import upload
 from gustelbot.util import voice
-from gustelbot.util.database import Database, FileCon, User
+from gustelbot.util.catalog import SoundCatalog
+from gustelbot.util.engine import UnitOfWork
+from gustelbot.util.reconciler import Reconciler
+from gustelbot.util.soundlist import SoundListView
+from gustelbot.util.soundlist import SoundPages
 
 
 class Sounds(commands.Cog):
+    MAX_UPLOAD_SIZE = 50000000
     SOUND_FOLDER: pathlib.Path
-    db: Database
+    OPUS_FOLDER: pathlib.Path
+    catalog: SoundCatalog
 
     def __init__(self, bot: commands.Bot, settings: config.Config):
         self.logger = logging.getLogger(__name__)
         self.bot = bot
         self.settings = settings
         self.SOUND_FOLDER = settings.folders["sounds_custom"]
-        self.check_files.start()
+        self.OPUS_FOLDER = settings.folders["sounds_opus"]
+        self.catalog = SoundCatalog(bot.db)
+        self.sound_pages = SoundPages(bot.db, self.catalog)
+        self.catalog.maintain.start()
+        # started once the storage migration is done
+        self.reconciler = Reconciler(bot.db, self.SOUND_FOLDER)
+        self.migrate_storage.start()
+        self.transcode_files.start()
+        # keeps references to running background transcodes
+        self.transcodes: set[asyncio.Task] = set()
+
+    def cog_unload(self):
+        self.reconciler.maintain.cancel()
+        self.migrate_storage.cancel()
+        self.transcode_files.cancel()
+        self.catalog.maintain.cancel()
+
+    @tasks.loop(hours=6)
+    async def transcode_files(self):
+        """
+        Measures the loudness of all sounds which weren't measured yet,
+        then creates the pre-normalized opus versions of all sounds which don't have one yet.
+        """
+        await self.catalog.wait_loaded()
+        try:
+            if measured := await loudness.backfill(self.bot.db, self.catalog.files(), self.SOUND_FOLDER):
+                self.logger.info(f"Measured loudness of {len(measured)} sounds.")
+                # transcodes use the new measurements
+                await self.catalog.reload(set(measured))
+            count = await transcode.backfill(self.catalog.files(), self.SOUND_FOLDER, self.OPUS_FOLDER)
+        except FileNotFoundError:
+            self.logger.warning("ffmpeg not found, sounds will be normalized during playback.")
+            self.transcode_files.cancel()
+            return
+        if count:
+            self.logger.info(f"Transcoded {count} sounds.")
+
+    @tasks.loop(count=1)
+    async def migrate_storage(self):
+        """
+        Moves sounds stored under their upload name to their content addressed place.
+        """
+        try:
+            migrated = await storage.migrate(self.bot.db, self.SOUND_FOLDER)
+        except Exception:
+            self.logger.exception("Failed to move sounds to content addressed storage.")
+            return
+        if migrated:
+            self.logger.info(f"Moved {migrated} sounds to content addressed storage.")
+
+    @migrate_storage.before_loop
+    async def before_migrate_storage(self):
+        await self.bot.wait_until_ready()
+
+    @migrate_storage.after_loop
+    async def after_migrate_storage(self):
+        # a scan during the migration would see files between their old and new name and mark them deleted
+        if not self.migrate_storage.is_being_cancelled():
+            self.reconciler.maintain.start()
 
-    @tasks.loop(seconds=120)
-    async def check_files(self):
+    async def autocomplete_sound_name(self, ctx: discord.AutocompleteContext) -> list[str]:
         """
-        Check if local files are up-to-date with
+        Suggests sound names from the catalog, sounds of the current server first.
         """
-        db_con = Database.new_connection()
-
-        db_expected_files = FileCon.get_file(db_con, deleted=False)
-        db_expected_file_set = {x.file_name for x in db_expected_files}
-
-        db_deleted_files = FileCon.get_file(db_con, deleted=True)
-        db_deleted_file_set = {x.file_name for x in db_deleted_files}
-
-        local_files = {x.name for x in self.SOUND_FOLDER.glob('**/*')}
-
-        # check missing files
-        missing_files = db_expected_file_set - local_files
-        for missing_file in missing_files:
-            file_id = FileCon.get_file(db_con, file_name=missing_file)
-            FileCon.mark_file_deleted(db_con, file_id[0].id, True)
-
-        # surplus files
-        surplus_files = local_files - db_expected_file_set
-        files_to_restore = surplus_files.union(db_deleted_file_set)
-        local_file_paths = list(self.SOUND_FOLDER.glob('**/*'))
-        restored_files = []
-        for local_file in local_file_paths:
-            # check if file is correct
-            if local_file.name in files_to_restore:
-                db_file = FileCon.get_file(db_con, file_name=local_file.name)
-                # if hash is correct, set as not deleted
-                if db_file and db_file[0].file_hash == filemgr.calculate_md5(local_file):
-                    FileCon.mark_file_deleted(db_con, db_file[0].id, False)
-                    restored_files.append(db_file[0].file_name)
-        db_con.commit()
-        if missing_files:
-            self.logger.info(f"Marked the files {missing_files} as deleted.")
-        if restored_files:
-            self.logger.info(f"Marked the files {restored_files} as restored.")
+        return self.catalog.complete(ctx.interaction.guild_id, ctx.value or "")
 
     @discord.slash_command(name="play", description="Plays sound in your current channel.")
-    @discord.option(name="sound_name", description="Name of the sound, leave empty for random choice", required=False)
-    async def play(self, ctx: discord.ApplicationContext, sound_name: str):
+    @discord.option(
+        name="sound_name", description="Name of the sound, leave empty for random choice", required=False,
+        autocomplete=autocomplete_sound_name
+    )
+    @discord.option(
+        name="tags", description="Comma seperated list of tags, the sound has to carry all of them", required=False
+    )
+    @discord.option(
+        name="layer", description="Play on top of the current sound instead of replacing it", required=False,
+        default=False
+    )
+    async def play(self, ctx: discord.ApplicationContext, sound_name: str, tags: str, layer: bool):
         """
         Play command, searches for random file if no name provided
         """
-        db_con = Database.new_connection()
-
         if not (response := (await voice.is_joinable(ctx)))[0]:
             await ctx.respond(response[1])
             return
+        tag_list = [x.strip() for x in tags.split(',') if x.strip()] if tags else None
         # choose sound to play
+        await self.catalog.wait_loaded()
         if sound_name:
-            sound = Sounds.__choose_sound(
-                db_con, ctx.author.id, ctx.guild_id, search_str=sound_name
-            )
+            sound = self.__choose_sound(ctx.author.id, ctx.guild_id, search_str=sound_name, tags=tag_list)
         else:
-            sound = Sounds.__choose_sound(
-                db_con, ctx.author.id, ctx.guild_id, Database.get_play_max_len(db_con, ctx.guild.id)
+            sound = self.__choose_sound(
+                ctx.author.id, ctx.guild_id, self.catalog.play_max_len(ctx.guild_id), tags=tag_list
             )
 
         # if still no sound was found, check for matching tag instead
-        # TODO: implement retrieval of file by tag
+        if sound is None and sound_name:
+            sound = self.__choose_sound(
+                ctx.author.id, ctx.guild_id, self.catalog.play_max_len(ctx.guild_id),
+                tags=[sound_name] + (tag_list or [])
+            )
 
         if sound is None:
             await ctx.respond("No matching sound found")
             return
 
-        await Sounds.play_sound(ctx, pathlib.Path(self.SOUND_FOLDER, sound.file_name), sound.display_name)
+        await Sounds.play_sound(
+            ctx, pathlib.Path(self.SOUND_FOLDER, sound.file_name), sound.display_name,
+            cached=transcode.cached_path(self.OPUS_FOLDER, sound.file_hash), gain=loudness.gain(sound),
+            queue_depth=self.catalog.play_queue(ctx.guild.id), layer=layer
+        )
 
     @discord.slash_command(name="stop", description="Stops playback")
     async def stop(self, ctx: discord.ApplicationContext):
@@ -135,16 +183,14 @@ class Sounds(commands.Cog):
     sound_group = discord.SlashCommandGroup(name="sound", description="Information and commands regarding sounds")
 
     @sound_group.command(name="list", description="Lists all sounds available")
-    async def sound_list(self, ctx: discord.ApplicationContext):
+    @discord.option(name="tag", description="Only list sounds with this tag", required=False)
+    @discord.option(name="uploader", type=discord.Member, description="Only list sounds of this user", required=False)
+    async def sound_list(self, ctx: discord.ApplicationContext, tag: str, uploader: discord.Member):
         """
-        Returns Embed that contains all sounds available
+        Returns Embed that lists the available sounds page by page
         """
-        db_con = Database.new_connection()
-        all_files = [x.display_name for x in FileCon.get_file(db_con, deleted=False)]
-        result_dict = {
-            "fields": [{"name": "All available files", "value": "\r".join(all_files)}],
-        }
-        await ctx.respond(embed=discord.Embed.from_dict(result_dict))
+        view = SoundListView(self.sound_pages, tag.strip() if tag else None, uploader)
+        await ctx.respond(embed=await view.first_page(), view=view)
 
     @sound_group.command(name="upload", description="Uploads sound to GustelBot")
     @discord.option(name="sound_file", type=discord.Attachment, description="Sound file to upload.")
@@ -159,9 +205,14 @@ class Sounds(commands.Cog):
         """
         Allows users to upload a new sound to GustelBot
         """
-        db_con = Database.new_connection()
-
-        if not (User.get_user(db_con, ctx.author.id)['uploader'] or self.settings.is_superuser(ctx.author.id)):
+        db = self.bot.db.unit_of_work(ctx)
+        # the file references its uploader, who might not be written to the database yet
+        await self.bot.known_users.ensure(ctx.author.id, ctx.author.name, ctx.guild_id, ctx.author.display_name)
+
+        if not (
+            (user := await db.user.get_user(ctx.author.id)) and user['uploader']
+            or self.settings.is_superuser(ctx.author.id)
+        ):
             await ctx.respond("You are not allowed to upload sounds to GustelBot.")
             return
 
@@ -169,7 +220,7 @@ class Sounds(commands.Cog):
             await ctx.respond('Failed to upload file: Not a valid audio file')
             return
 
-        if sound_file.size > 50000000:
+        if sound_file.size > self.MAX_UPLOAD_SIZE:
             await ctx.respond('Failed to upload file: Maximum size is 50MB')
             return
 
@@ -190,58 +241,97 @@ class Sounds(commands.Cog):
             tag_tup = None
 
         # check if provided display name is already in use (and visible)
-        if FileCon.get_file(db_con, display_name=sound_name):
+        if await db.file.get_file(display_name=sound_name, deleted=False):
             await ctx.respond(f'**Error**: The Filename `{sound_name}` is already in use!')
             return
 
-        # save file to tmp and attach random string to provided name
+        # no connection is held while downloading and measuring, the file is added in a short transaction at the end
+        await db.release()
+
+        # stream file to tmp and attach random string to provided name, it is hashed while downloading
         await ctx.respond('Uploading sound to GustelBot...')
         random_str = string.ascii_lowercase
         random_str = "".join(random.sample(random_str, 5))
         tmp_file_path = pathlib.Path(f'{tempfile.gettempdir()}/{random_str}+{sound_file.filename}')
-        await sound_file.save(fp=tmp_file_path)
+        try:
+            file_md5, file_size = await upload.download(sound_file.url, tmp_file_path, self.MAX_UPLOAD_SIZE)
+        except upload.UploadError as e:
+            await ctx.respond(f'Failed to upload file: {e}')
+            return
 
-        # calculate hash of file and check db if already exists
-        file_md5 = filemgr.calculate_md5(tmp_file_path)
-        if existing_file := FileCon.get_file(db_con, file_hash=file_md5):
+        # check db if already exists, before any further work is done
+        if existing_file := await db.file.get_file(file_hash=file_md5):
             existing_file = existing_file[0]
+            tmp_file_path.unlink(missing_ok=True)
             await ctx.respond(f'Your upload `{sound_name}` already exists as `{existing_file.display_name}`')
             return
+        await db.release()
+
+        if (seconds := await upload.probe(tmp_file_path)) is None:
+            tmp_file_path.unlink(missing_ok=True)
+            await ctx.respond('Failed to upload file: Not a valid audio file')
+            return
+
+        # measure loudness once, playback applies a static gain based on it
+        try:
+            measurement = await loudness.measure(tmp_file_path) or (None, None, None)
+        except FileNotFoundError:
+            measurement = (None, None, None)
 
         # create new file
-        self.__create_sound_file(
-            db_con,
+        await self.__create_sound_file(
+            db,
             dataclasses.File(
-                size=tmp_file_path.stat().st_size,
+                size=file_size,
                 guild_id=ctx.guild.id,
                 user_id=ctx.author.id,
                 display_name=sound_name,
                 file_name=tmp_file_path.name,
                 file_hash=file_md5,
-                seconds=math.floor(filemgr.get_sound_length(tmp_file_path)),
-                tags=tag_tup
+                seconds=math.floor(seconds),
+                tags=tag_tup,
+                loudness=measurement[0],
+                true_peak=measurement[1],
+                loudness_range=measurement[2]
             ),
             tmp_file_path
         )
-        db_con.commit()
         await ctx.respond(f'Sound `{sound_name}` successfully uploaded to GustelBot')
 
-    def __create_sound_file(self, db_con: connection, file: dataclasses.File, source_file: pathlib.Path):
+    async def __create_sound_file(self, db: UnitOfWork, file: dataclasses.File, source_file: pathlib.Path):
         """
-        Establishes a new Sound file in the database and copies it to the folder.
+        Establishes a new Sound file in the database and moves it to its content addressed place in the folder.
         """
         # move file to proper folder
         try:
-            filemgr.move_to_folder(source_file, self.SOUND_FOLDER)
-        except (FileNotFoundError, NotADirectoryError):
-            logging.error(f'Failed to move file to proper folder: {traceback.format_exc()}')
+            file.file_name, created = await storage.store(source_file, self.SOUND_FOLDER, file.file_hash)
+        except OSError as e:
+            self.logger.error(f'Failed to move file to proper folder: {traceback.format_exc()}')
+            source_file.unlink(missing_ok=True)
+            raise e
         try:
-            FileCon.add_file(db_con, file)
-            db_con.commit()
+            await db.file.add_file(file)
+            await db.commit()
         except Exception as e:
             self.logger.error(f'Failed to add file {source_file.name} to database: {traceback.format_exc()}')
-            pathlib.Path(self.SOUND_FOLDER, source_file.name).unlink()
+            # a file which existed already belongs to another sound
+            if created:
+                pathlib.Path(self.SOUND_FOLDER, file.file_name).unlink(missing_ok=True)
             raise e
+        # normalize the new sound in the background, it is played with live normalization until then
+        task = asyncio.create_task(self.__transcode_file(file))
+        self.transcodes.add(task)
+        task.add_done_callback(self.transcodes.discard)
+
+    async def __transcode_file(self, file: dataclasses.File):
+        try:
+            await transcode.transcode(
+                pathlib.Path(self.SOUND_FOLDER, file.file_name),
+                transcode.cached_path(self.OPUS_FOLDER, file.file_hash),
+                loudness.gain(file)
+            )
+        except FileNotFoundError:
+            self.logger.warning("ffmpeg not found, could not transcode the uploaded sound.")
 
     @sound_upload.error
     async def on_sound_upload_error(self, ctx: discord.ApplicationContext, _: discord.DiscordException):
@@ -253,11 +343,12 @@ class Sounds(commands.Cog):
         await ctx.respond('Internal server error.')
 
     @sound_group.command(name='details', description='Returns details about a sound.')
-    @discord.option(name="sound_name", description="Name of the sound.")
+    @discord.option(name="sound_name", description="Name of the sound.", autocomplete=autocomplete_sound_name)
     async def sound_details(self, ctx: discord.ApplicationContext, sound_name: str):
         """
         Returns details about a sound, same behaviour as play
         """
+        await self.catalog.wait_loaded()
         sound = self.__choose_sound(ctx.author.id, ctx.guild_id, search_str=sound_name)
 
         if not sound:
@@ -268,7 +359,6 @@ class Sounds(commands.Cog):
             f"`name  :` {sound.display_name}",
             f"`id    :` {sound.id}",
             f"`length:` {timedelta(seconds=sound.seconds)}",
-            f"`public:` {sound.public}",
             f"`tags  :` {', '.join(sound.tags)}",
         ]
         embed = {
@@ -278,9 +368,8 @@ class Sounds(commands.Cog):
 
         await ctx.respond(embed=discord.Embed.from_dict(embed))
 
-    @staticmethod
     def __choose_sound(
-            conn: connection,
+            self,
             user_id: int,
             guild_id: int,
             max_len: typing.Optional[int] = None,
@@ -288,51 +377,56 @@ class Sounds(commands.Cog):
             tags: list[str] = None
     ) -> typing.Optional[dataclasses.File]:
         """
-        Searches database for fitting sound and returns path to sound file.
+        Searches the catalog for fitting sound and returns path to sound file.
         """
-        all_sounds = FileCon.get_file(conn, deleted=False)
+        # if search string is provided, take the best match above the similarity threshold
+        if search_str:
+            matches = self.catalog.search(search_str, threshold=0.65, limit=1, max_len=max_len, all_of=tags or ())
+            return matches[0][0] if matches else None
+
+        if not tags:
+            return self.catalog.random(guild_id, max_len)
+
+        # if tags are provided, only consider files carrying all of them
+        all_sounds = self.catalog.tagged(all_of=tags)
 
         # if max_len is set filter list for that
         if max_len:
             all_sounds = [sound for sound in all_sounds if sound.seconds <= max_len]
 
-        # if tags are provided, filter by the tags
-        if tags:
-            for tag in tags:
-                all_sounds = [sound for sound in all_sounds if tag in sound.tags]
-
-        # if search string is provided, rank by likelihood of being a match
-        if search_str:
-            all_sounds = [
-                (sound,
-                 SequenceMatcher(
-                     None,
-                     sound.display_name.lower(),
-                     search_str.lower()
-                 ).ratio()) for sound in all_sounds
-            ]
-            all_sounds = sorted(all_sounds, key=lambda x: x[1], reverse=True)
-
         if len(all_sounds) == 0:
             return None
-        if isinstance(all_sounds[0], tuple):
-            return all_sounds[0][0] if all_sounds[0][1] >= 0.65 else None
-        else:
-            return all_sounds[0]
+        return random.choice(all_sounds)
 
     @staticmethod
-    async def play_sound(ctx, sound: pathlib.Path, name: str = None):
+    async def play_sound(
+            ctx, sound: pathlib.Path, name: str = None, cached: pathlib.Path = None, gain: float = None,
+            queue_depth: int = 0, layer: bool = False
+    ):
         """
         Actually playing the sound. This expects the provided file to work!
         If a name is provided it will be announced.
+        cached is the path of a pre-normalized version of the sound, which is preferred if it exists.
+        gain is the static gain in dB applied otherwise, without it the sound is normalized dynamically.
+        With a queue_depth the sound is queued behind the playing one instead of replacing it,
+        layered sounds are mixed into the playing one.
         """
-        if name:
-            await ctx.respond(f"Playing '{name}'")
         if not sound.exists():
             await ctx.respond("Error: The specified sound does not exist.")
             return
+        if name and not ctx.response.is_done():
+            # joining can take longer than discord waits for a response
+            await ctx.defer()
         await voice.join_channel(ctx, ctx.author.voice.channel)
-        await voice.play_sound(ctx, f"{str(sound)}")
+        queued = queue_depth and not layer and ctx.voice_client.is_playing()
+        if not await voice.play_sound(
+                ctx, f"{str(sound)}", cached=cached, gain=gain, queue_depth=queue_depth, layer=layer
+        ):
+            reason = "Too many sounds are playing" if layer else "The queue is full"
+            await ctx.respond(f"{reason}, '{name or sound.stem}' was not added.")
+            return
+        if name:
+            await ctx.respond(f"Queued '{name}'" if queued else f"Playing '{name}'")
 
     @staticmethod
     async def join_preparation(ctx: discord.ApplicationContext) -> bool:
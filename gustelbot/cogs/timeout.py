@@ -1,70 +1,91 @@
 # default
 import logging
 import asyncio
-import os
-import time
 # pip
 import discord
 from discord.ext import commands
 # internal
 from gustelbot.util import config
+from gustelbot.util.scheduler import DeadlineScheduler
 
 
 class Timeout(commands.Cog):
     """
-    This class is supposed to handle bot timeouts. Currently only using voice_state as basis.
+    This class is supposed to handle bot timeouts. The bot leaves voice channels after max_time seconds
+    without playing anything. Idle deadlines are set by voice state and playback events, nothing is polled.
     """
-    def __init__(self, bot, _: config.Config):
+    max_time = 180
+
+    def __init__(self, bot, settings: config.Config):
+        self.logger = logging.getLogger(__name__)
         self.bot = bot
+        self.settings = settings
+        # deadlines per guild id
+        self.idle = DeadlineScheduler(self.disconnect_idle)
+
+    def cog_unload(self):
+        self.idle.close()
 
     @commands.Cog.listener()
     async def on_voice_state_update(self,
                                     member: discord.Member,
-                                    _: discord.VoiceState,
+                                    before: discord.VoiceState,
                                     after: discord.VoiceState):
         """
-        Handles automatic disconnection after max_time seconds of inactivity. Only handles sending, not recording.
+        Starts the idle timer when the bot joins or switches a channel, stops it when the bot left.
         """
-        logging.debug("<timeout> - voice state update")
-
         if not member.id == self.bot.user.id:
             return
-        if after is None:
-            return
 
-        # disconnect once this variable reaches max_time
-        dc_timer = 0
-        max_time = 180
-        voice_client = self.get_voice_client(after.channel)
-
-        if voice_client is None:
+        if after is None or after.channel is None:
+            self.idle.cancel(member.guild.id)
             return
+        # mute and deafen changes
+        if before is not None and before.channel == after.channel:
+            return
+        if member.guild.voice_client is not None and member.guild.voice_client.is_playing():
+            return
+        self.logger.debug(f"Disconnecting from {after.channel} in {self.max_time}s if nothing is played.")
+        self.idle.schedule(member.guild.id, self.max_time)
 
-        try:
-            while self.bot.user in after.channel.members:
-                await asyncio.sleep(1)
-                dc_timer += 1
-                logging.debug(f"Disconnect timer for {after.channel}, {max_time - dc_timer}s left.")
-
-                if voice_client.is_playing():
-                    dc_timer = 0
+    @commands.Cog.listener()
+    async def on_playback_start(self, voice_client: discord.VoiceClient):
+        self.idle.cancel(voice_client.guild.id)
 
-                if dc_timer >= max_time:
-                    voice_client.play(
-                        discord.FFmpegOpusAudio(os.path.join(config.Config().folders["sounds_default"], "timeout.wav")))
-                    while voice_client.is_playing():
-                        time.sleep(1)
-                    await voice_client.disconnect()
-                    return
-        # this is called when bot has been disconnected
-        except Exception as e:
-            print(e)
+    @commands.Cog.listener()
+    async def on_playback_end(self, voice_client: discord.VoiceClient):
+        # stopping a sound to play the next one ends the previous playback afterwards
+        if voice_client.is_connected() and not voice_client.is_playing():
+            self.idle.schedule(voice_client.guild.id, self.max_time)
 
-    def get_voice_client(self, channel: discord.channel) -> discord.VoiceClient | None:
+    async def disconnect_idle(self, guild_id: int):
         """
-        Returns voice client if bot is in a channel.
+        Plays the timeout sound and leaves the channel of the guild.
         """
-        for client in self.bot.voice_clients:
-            if client.channel == channel:
-                return client
-        return None
+        guild = self.bot.get_guild(guild_id)
+        if guild is None or guild.voice_client is None:
+            return
+        voice_client: discord.VoiceClient = guild.voice_client
+        if voice_client.is_playing():
+            self.idle.schedule(guild_id, self.max_time)
+            return
+
+        self.logger.info(f"Leaving {voice_client.channel} after {self.max_time}s of inactivity.")
+        timeout_sound = self.settings.folders["sounds_default"].joinpath("timeout.wav")
+        finished = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        try:
+            # not dispatched as playback, that would restart the timer
+            voice_client.play(
+                self.bot.audio_cache.source(timeout_sound) or discord.FFmpegOpusAudio(str(timeout_sound)),
+                after=lambda _: loop.call_soon_threadsafe(finished.set)
+            )
+            await finished.wait()
+        except discord.ClientException:
+            # the bot has been disconnected meanwhile
+            pass
+        # a /play stops the timeout sound, the bot stays then
+        if voice_client.is_playing():
+            self.idle.schedule(guild_id, self.max_time)
+            return
+        await voice_client.disconnect()
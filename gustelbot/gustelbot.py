@@ -3,6 +3,7 @@ Main entry point for GustelBot
 """
 # default
 import logging
+import sys
 import traceback
 
 # pip
@@ -11,8 +12,10 @@ from discord.ext import commands
 from discord.ext import tasks
 # internal
 from gustelbot.util import config
+from gustelbot.util.audiocache import FrameCache
 from gustelbot.util.database import Database
-from gustelbot.util.database import User
+from gustelbot.util.engine import Engine
+from gustelbot.util.writebehind import UserWriteBehind
 
 
 # Set loglevel, ignoring config until config file works
@@ -24,6 +27,7 @@ try:
     db_con = Database.new_connection()
     Database.check(db_con)
     db_con.commit()
+    db_con.close()
 except Exception:
     logging.critical(traceback.format_exc())
     exit()
@@ -34,14 +38,48 @@ logging.basicConfig(level=settings.get_loglevel(), force=True)
 # specify intents (permission stuff)
 intents = discord.Intents.default()
 
+
+class GustelBot(commands.Bot):
+    """
+    Bot holding the database engine and audio cache shared by all cogs.
+    """
+    db: Engine
+    known_users: UserWriteBehind
+    audio_cache: FrameCache
+
+    def __init__(self, db: Engine, audio_cache: FrameCache, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db = db
+        self.known_users = UserWriteBehind(db)
+        self.audio_cache = audio_cache
+
+    async def close(self):
+        await super().close()
+        self.known_users.flush.cancel()
+        await self.known_users.flush()
+        await self.db.close()
+
+
 # Create bot object
-bot = commands.Bot(case_insensitive=True, intents=intents, debug_guilds=settings.get_debug_guilds())
+bot = GustelBot(
+    Engine.from_config(settings),
+    FrameCache(settings.get_audio_cache_size()),
+    case_insensitive=True,
+    intents=intents,
+    debug_guilds=settings.get_debug_guilds()
+)
 
 
 # ----- database maintenance
 @bot.event
 async def on_ready():
     logging.info(f"Successfully logged in as {bot.user}")
+    await bot.db.open()
+    if not bot.known_users.flush.is_running():
+        bot.known_users.flush.start()
+    if not len(bot.audio_cache):
+        count = await bot.audio_cache.preload(settings.folders["sounds_default"])
+        logging.info(f"Cached {count} default sounds.")
 
     logging.info("Setting status.")
     await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name="Alexander Marcus"))
@@ -51,13 +89,15 @@ async def on_ready():
 @bot.event
 async def on_guild_join(guild: discord.Guild):
     logging.info(f"Joined {guild.name}")
-    Database.add_server(db_con, server_id=guild.id, name=guild.name)
+    async with bot.db.connection() as db:
+        await db.database.add_server(server_id=guild.id, name=guild.name)
 
 
 @bot.event
 async def on_guild_update(_, guild: discord.Guild):
     logging.info(f"Guild {guild.name} was updated")
-    Database.add_server(db_con, server_id=guild.id, name=guild.name)
+    async with bot.db.connection() as db:
+        await db.database.add_server(server_id=guild.id, name=guild.name)
 
 
 @tasks.loop(hours=1)
@@ -66,23 +106,30 @@ async def check_guilds():
     Checks if all guilds are part of the database and data is up-to-date
     """
     discord_guilds = [guild async for guild in bot.fetch_guilds()]
-    for guild in discord_guilds:
-        if (srv := Database.get_server(db_con, server_id=guild.id)) is not None:
-            if srv['servername'] == guild.name:
+    async with bot.db.connection() as db:
+        known = {srv['server_id']: srv['servername'] for srv in await db.database.get_server()}
+        for guild in discord_guilds:
+            if known.get(guild.id) == guild.name:
                 continue
-        Database.add_server(db_con, server_id=guild.id, name=guild.name)
-    db_con.commit()
+            await db.database.add_server(server_id=guild.id, name=guild.name)
 
 
 @bot.before_invoke
 async def ensure_user(ctx: commands.Context | discord.ApplicationContext):
     """
-    Ensures that the calling user is in the database.
+    Ensures that the calling user is in the database. Changes are written in the background.
     """
-    logging.debug("Attempting to create user %s", ctx.author.name)
-    User.add_user(db_con, ctx.author.id, ctx.author.name)
-    User.add_user_display_name(db_con, ctx.author.id, ctx.guild_id, ctx.author.display_name)
-    db_con.commit()
+    if bot.known_users.touch(ctx.author.id, ctx.author.name, ctx.guild_id, ctx.author.display_name):
+        logging.debug("Queued update of user %s", ctx.author.name)
+
+
+@bot.after_invoke
+async def finish_unit_of_work(ctx: commands.Context | discord.ApplicationContext):
+    """
+    Commits everything the command wrote in a single transaction, rolls back if it failed.
+    """
+    # after hooks are called from the command's finally block, a raised exception is still visible here
+    await bot.db.finish(ctx, commit=sys.exc_info()[0] is None)
 
 
 def load_extensions():
@@ -0,0 +1,151 @@
+# default
+import asyncio
+import collections
+import io
+import logging
+import pathlib
+# pip
+import discord
+from discord.oggparse import OggError
+from discord.oggparse import OggStream
+# internal
+from . import transcode
+
+
+class CachedOpusAudio(discord.AudioSource):
+    """
+    Plays already encoded 20ms Opus frames from memory, no subprocess is involved.
+    """
+    def __init__(self, frames: tuple[bytes, ...]):
+        self.frames = frames
+        self._position = 0
+
+    def read(self) -> bytes:
+        if self._position >= len(self.frames):
+            return b""
+        frame = self.frames[self._position]
+        self._position += 1
+        return frame
+
+    def is_opus(self) -> bool:
+        return True
+
+
+class FrameCache:
+    """
+    LRU cache of Opus frames per audio file, limited to max_bytes of frame data.
+    Ogg/Opus files are split into frames directly, other files are encoded with ffmpeg once.
+    """
+    def __init__(self, max_bytes: int):
+        self.logger = logging.getLogger(__name__)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: collections.OrderedDict[pathlib.Path, tuple[bytes, ...]] = collections.OrderedDict()
+        self._loading: dict[pathlib.Path, asyncio.Task] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path: pathlib.Path):
+        return path in self._entries
+
+    def source(self, path: pathlib.Path) -> CachedOpusAudio | None:
+        """
+        Returns an AudioSource of the cached frames of path, None if it is not cached.
+        """
+        if (frames := self._entries.get(path)) is None:
+            return None
+        self._entries.move_to_end(path)
+        return CachedOpusAudio(frames)
+
+    async def load(self, path: pathlib.Path, gain: float | None = None) -> CachedOpusAudio | None:
+        """
+        Caches path if it isn't yet and returns an AudioSource of it, None if it could not be loaded.
+        gain is only applied when the file has to be encoded, Ogg/Opus files are expected to be normalized.
+        Raises FileNotFoundError if ffmpeg is needed but not installed.
+        """
+        if (source := self.source(path)) is not None:
+            return source
+        # concurrent requests for the same file share one load
+        if (task := self._loading.get(path)) is None:
+            task = asyncio.create_task(self.__load(path, gain))
+            self._loading[path] = task
+            task.add_done_callback(lambda _: self._loading.pop(path, None))
+        try:
+            frames = await asyncio.shield(task)
+        except FileNotFoundError:
+            raise
+        except (OSError, OggError):
+            self.logger.exception(f"Failed to cache {path.name}.")
+            return None
+        if frames is None:
+            return None
+        self.__put(path, frames)
+        return CachedOpusAudio(frames)
+
+    async def preload(self, folder: pathlib.Path) -> int:
+        """
+        Caches all files in folder and its sub-folders, returns the amount of cached files.
+        """
+        files = [x for x in sorted(folder.rglob("*")) if x.is_file()]
+        count = 0
+        for file in files:
+            try:
+                if await self.load(file) is not None:
+                    count += 1
+            except FileNotFoundError:
+                self.logger.warning("ffmpeg not found, default sounds are not cached.")
+                break
+        return count
+
+    # -- "private" functions
+
+    def __put(self, path: pathlib.Path, frames: tuple[bytes, ...]):
+        size = sum(len(x) for x in frames)
+        if size > self.max_bytes:
+            return
+        if (old := self._entries.pop(path, None)) is not None:
+            self.size -= sum(len(x) for x in old)
+        self._entries[path] = frames
+        self.size += size
+        # evict least recently used files
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= sum(len(x) for x in evicted)
+
+    async def __load(self, path: pathlib.Path, gain: float | None) -> tuple[bytes, ...] | None:
+        if path.suffix == ".ogg":
+            data = await asyncio.to_thread(path.read_bytes)
+            # might be Ogg/Vorbis, which has to be encoded as well
+            if (frames := await asyncio.to_thread(FrameCache.split_frames, data)) is not None:
+                return frames
+        if (data := await FrameCache.__encode(path, gain)) is None:
+            return None
+        return await asyncio.to_thread(FrameCache.split_frames, data)
+
+    @staticmethod
+    async def __encode(path: pathlib.Path, gain: float | None) -> bytes | None:
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+            "-i", str(path),
+            *transcode.encoder_arguments(gain), "pipe:1",
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            logging.error(f"Failed to encode {path.name}: {stderr.decode(errors='replace').strip()}")
+            return None
+        return stdout
+
+    @staticmethod
+    def split_frames(data: bytes) -> tuple[bytes, ...] | None:
+        """
+        Returns the Opus packets of an Ogg/Opus file without the two header packets, None if it isn't Opus.
+        """
+        packets = OggStream(io.BytesIO(data)).iter_packets()
+        if not next(packets, b"").startswith(b"OpusHead"):
+            return None
+        next(packets, None)
+        return tuple(packets)
@@ -0,0 +1,299 @@
+# default
+import asyncio
+import logging
+# pip
+import psycopg2
+from discord.ext import tasks
+from psycopg2.extensions import connection
+# internal
+from . import dataclasses
+from .database import Database
+from .engine import Engine
+from .search import PrefixIndex
+from .search import SimilarityIndex
+from .search import TagIndex
+from .selection import DurationIndex
+from .selection import ShuffleBag
+
+
+class SoundCatalog:
+    """
+    In-memory copy of all visible files and the per-server play settings.
+    Triggers on files, files_tags and discord_servers send notifications, which are used to reload
+    only the changed rows. If notifications can't be received the catalog is reloaded completely.
+    """
+    CHANNELS = ('files_changed', 'servers_changed')
+
+    def __init__(self, engine: Engine):
+        self.logger = logging.getLogger(__name__)
+        self.engine = engine
+        # incremented on every change, allows derived data to detect staleness
+        self.version = 0
+        self._files: dict[int, dataclasses.File] = {}
+        self._play_max_len: dict[int, int] = {}
+        self._play_queue: dict[int, int] = {}
+        self._names = SimilarityIndex()
+        # prefix indexes of all files, and of the files uploaded per server
+        self._prefixes = PrefixIndex()
+        self._server_prefixes: dict[int, PrefixIndex] = {}
+        self._tags = TagIndex()
+        self._durations = DurationIndex()
+        # per server: (_durations generation, max_len, bag over the eligible part of _durations)
+        self._bags: dict[int, tuple[int, int, ShuffleBag]] = {}
+        self._last_played: dict[int, int] = {}
+        self._loaded = asyncio.Event()
+        self._listener: connection | None = None
+        self._changed_files: set[int] = set()
+        self._changed_servers: set[int] = set()
+        self._reload_task: asyncio.Task | None = None
+        # files reloaded while a full refresh is running, the refresh might overwrite them with older data
+        self._reloaded_during_refresh: set[int] | None = None
+
+    def files(self) -> list[dataclasses.File]:
+        """Returns all visible files"""
+        return list(self._files.values())
+
+    def get(self, file_id: int) -> dataclasses.File | None:
+        return self._files.get(file_id)
+
+    def search(
+            self, text: str, threshold: float = 0.65, limit: int = 32,
+            max_len: int | None = None, all_of: list[str] = ()
+    ) -> list[tuple[dataclasses.File, float]]:
+        """
+        Returns (file, similarity) of the files whose display name is similar to text, best first.
+        Only files not longer than max_len seconds (0 or None means unlimited) and carrying all tags of all_of
+        are considered, so filtered files don't take up the limit.
+        """
+        tagged = self._tags.all_of(all_of) if all_of else None
+
+        def accept(file_id: int) -> bool:
+            if max_len and (self._files[file_id].seconds or 0) > max_len:
+                return False
+            return tagged is None or file_id in tagged
+
+        results = self._names.search(text, threshold, limit, accept if max_len or tagged is not None else None)
+        return [(self._files[x], ratio) for x, ratio in results]
+
+    def random(self, server_id: int, max_len: int | None = None) -> dataclasses.File | None:
+        """
+        Returns a random file not longer than max_len seconds, 0 or None means unlimited.
+        Per server, every eligible file is chosen once before any of them repeats.
+        """
+        size = self._durations.count(max_len)
+        if size == 0:
+            return None
+        # only a changed order of the durations invalidates the drawn positions, not any catalog change
+        generation, bag_max_len, bag = self._bags.get(server_id, (None, None, None))
+        if bag is None or generation != self._durations.generation or bag_max_len != max_len:
+            bag = ShuffleBag(size)
+            self._bags[server_id] = (self._durations.generation, max_len, bag)
+        file_id = self._durations.at(bag.draw())
+        # a new bag might start with the file played last
+        if file_id == self._last_played.get(server_id) and size > 1:
+            file_id = self._durations.at(bag.draw())
+        self._last_played[server_id] = file_id
+        return self._files[file_id]
+
+    def tagged(self, all_of: list[str] = (), any_of: list[str] = ()) -> list[dataclasses.File]:
+        """
+        Returns files carrying all tags of all_of and at least one tag of any_of.
+        """
+        if all_of and any_of:
+            file_ids = self._tags.all_of(all_of) & self._tags.any_of(any_of)
+        elif all_of:
+            file_ids = self._tags.all_of(all_of)
+        else:
+            file_ids = self._tags.any_of(any_of)
+        return [self._files[x] for x in file_ids]
+
+    def complete(self, server_id: int | None, prefix: str, limit: int = 25) -> list[str]:
+        """
+        Returns display names starting with prefix, files uploaded on the given server first.
+        """
+        result = {}
+        if server_id in self._server_prefixes:
+            result.update(self._server_prefixes[server_id].lookup(prefix, limit))
+        if len(result) < limit:
+            for key, name in self._prefixes.lookup(prefix, limit):
+                result.setdefault(key, name)
+        return list(result.values())[:limit]
+
+    def play_max_len(self, server_id: int) -> int:
+        """Returns max length of randomly chosen sounds, 0 means unlimited"""
+        return self._play_max_len.get(server_id) or 0
+
+    def play_queue(self, server_id: int) -> int:
+        """Returns how many sounds can be queued behind the playing one, 0 means no queue"""
+        return self._play_queue.get(server_id) or 0
+
+    async def wait_loaded(self):
+        """Loads the catalog if this did not happen yet"""
+        if not self._loaded.is_set():
+            await self.refresh()
+
+    async def refresh(self):
+        """
+        Reloads the complete catalog.
+        """
+        self._reloaded_during_refresh = set()
+        try:
+            async with self.engine.connection() as db:
+                files = await db.file.get_file(deleted=False)
+                servers = await db.database.get_server()
+            self._files = {x.id: x for x in files}
+            self._names.clear()
+            by_server: dict[int, list[tuple[int, str]]] = {}
+            self._tags.clear()
+            for file in files:
+                self._names.add(file.id, file.display_name)
+                self._tags.add(file.id, file.tags)
+                by_server.setdefault(file.guild_id, []).append((file.id, file.display_name))
+            self._prefixes.build([(x.id, x.display_name) for x in files])
+            self._durations.build([(x.id, x.seconds) for x in files])
+            self._server_prefixes = {}
+            for server_id, items in by_server.items():
+                self._server_prefixes[server_id] = PrefixIndex()
+                self._server_prefixes[server_id].build(items)
+            self._play_max_len = {x['server_id']: x['play_maxlen'] for x in servers}
+            self._play_queue = {x['server_id']: x['play_queue'] for x in servers}
+            self.version += 1
+            self._loaded.set()
+        finally:
+            reloaded, self._reloaded_during_refresh = self._reloaded_during_refresh, None
+        if reloaded:
+            self._changed_files |= reloaded
+            self.__schedule_reload()
+        self.logger.info("Loaded %s files into the sound catalog.", len(self._files))
+
+    async def reload(self, file_ids: set[int] = frozenset(), server_ids: set[int] = frozenset()):
+        """
+        Reloads only the given files and servers.
+        """
+        async with self.engine.connection() as db:
+            files = await db.file.get_files_by_id(list(file_ids)) if file_ids else []
+            server_ids = list(server_ids)
+            servers = [await db.database.get_server(server_id=x) for x in server_ids]
+        if self._reloaded_during_refresh is not None:
+            self._reloaded_during_refresh |= file_ids
+        found = set()
+        for file in files:
+            found.add(file.id)
+            self.__remove(file.id)
+            if file.deleted:
+                self._durations.remove(file.id)
+            else:
+                self.__add(file)
+        # rows which no longer exist
+        for file_id in file_ids - found:
+            self.__remove(file_id)
+            self._durations.remove(file_id)
+        for server_id, server in zip(server_ids, servers):
+            if server is None:
+                self._play_max_len.pop(server_id, None)
+                self._play_queue.pop(server_id, None)
+            else:
+                self._play_max_len[server_id] = server['play_maxlen']
+                self._play_queue[server_id] = server['play_queue']
+        self.version += 1
+
+    @tasks.loop(seconds=30)
+    async def maintain(self):
+        """
+        (Re)connects the notification listener, the catalog is reloaded completely after connecting.
+        """
+        if self._listener is not None and not self._listener.closed:
+            return
+        try:
+            self._listener = await asyncio.to_thread(SoundCatalog.__listen)
+        except psycopg2.Error:
+            self.logger.warning("Failed to listen for catalog changes, retrying later.", exc_info=True)
+            self._listener = None
+        else:
+            asyncio.get_running_loop().add_reader(self._listener.fileno(), self.__on_notify)
+        # changes may have been missed while not listening
+        try:
+            await self.refresh()
+        except Exception:
+            self.logger.exception("Failed to load the sound catalog.")
+
+    @maintain.after_loop
+    async def stop_listening(self):
+        if self._listener is not None:
+            self.__close_listener()
+
+    # -- "private" functions
+
+    def __add(self, file: dataclasses.File):
+        self._files[file.id] = file
+        self._names.add(file.id, file.display_name)
+        self._tags.add(file.id, file.tags)
+        self._durations.add(file.id, file.seconds)
+        self._prefixes.add(file.id, file.display_name)
+        self._server_prefixes.setdefault(file.guild_id, PrefixIndex()).add(file.id, file.display_name)
+
+    def __remove(self, file_id: int):
+        """
+        Removes the file from all indexes but _durations, re-adding a file with the same length keeps the shuffle bags.
+        """
+        if (file := self._files.pop(file_id, None)) is None:
+            return
+        self._names.remove(file_id)
+        self._tags.remove(file_id)
+        self._prefixes.remove(file_id)
+        if file.guild_id in self._server_prefixes:
+            self._server_prefixes[file.guild_id].remove(file_id)
+
+    @staticmethod
+    def __listen() -> connection:
+        conn = Database.new_connection()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            for channel in SoundCatalog.CHANNELS:
+                cur.execute(f"LISTEN {channel};")
+        return conn
+
+    def __close_listener(self):
+        try:
+            asyncio.get_running_loop().remove_reader(self._listener.fileno())
+        except (ValueError, psycopg2.Error):
+            pass
+        self._listener.close()
+        self._listener = None
+
+    def __on_notify(self):
+        """
+        Called by the event loop when the listener connection is readable.
+        """
+        try:
+            self._listener.poll()
+        except psycopg2.Error:
+            self.logger.warning("Lost connection for catalog notifications.")
+            self.__close_listener()
+            return
+        while self._listener.notifies:
+            notify = self._listener.notifies.pop(0)
+            if notify.channel == 'files_changed':
+                self._changed_files.add(int(notify.payload))
+            elif notify.channel == 'servers_changed':
+                self._changed_servers.add(int(notify.payload))
+        self.__schedule_reload()
+
+    def __schedule_reload(self):
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.create_task(self.__reload_changed())
+
+    async def __reload_changed(self):
+        # collect notifications arriving in the same loop iteration, then fetch them in one go
+        await asyncio.sleep(0)
+        while self._changed_files or self._changed_servers:
+            file_ids, self._changed_files = self._changed_files, set()
+            server_ids, self._changed_servers = self._changed_servers, set()
+            try:
+                await self.reload(file_ids, server_ids)
+            except Exception:
+                self.logger.exception("Failed to reload changed catalog entries.")
+                # the next maintenance run reconnects and reloads everything
+                if self._listener is not None:
+                    self.__close_listener()
+                return
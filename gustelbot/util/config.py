@@ -18,7 +18,8 @@ class Config:
         "data": Path(),
         "sounds": Path(),
         "sounds_default": Path(),
-        "sounds_custom": Path()
+        "sounds_custom": Path(),
+        "sounds_opus": Path()
     }
     # configuration options and their default
     options = {
@@ -28,6 +29,10 @@ class Config:
         "POSTGRES_DB": "gustelbot",
         "POSTGRES_USER": "gustelbot",
         "POSTGRES_PASSWORD": "password",
+        "POSTGRES_POOL_MIN": "1",
+        "POSTGRES_POOL_MAX": "10",
+        "POSTGRES_POOL_IDLE": "300",
+        "AUDIO_CACHE_MB": "32",
         "DISCORD_TOKEN": "xxxxx",
         "DISCORD_DEBUG_GUILDS": ""
     }
@@ -42,6 +47,8 @@ class Config:
         # default folder cannot be played from /play command
         self.folders["sounds_default"] = Path(self.folders["sounds"]).joinpath("default")
         self.folders["sounds_custom"] = Path(self.folders["sounds"]).joinpath("custom")
+        # loudness normalized opus versions of custom sounds, named by file hash
+        self.folders["sounds_opus"] = Path(self.folders["sounds"]).joinpath("opus")
 
         for folder in self.folders.values():
             Config.ensure_folder(folder)
@@ -106,6 +113,24 @@ class Config:
             "password": os.environ.get("POSTGRES_PASSWORD")
         }
 
+    @staticmethod
+    def get_pool_config() -> dict:
+        """
+        Returns size limits of the database connection pool
+        {min,max,idle}
+        """
+        return {
+            "min": int(os.environ.get("POSTGRES_POOL_MIN")),
+            "max": int(os.environ.get("POSTGRES_POOL_MAX")),
+            "idle": float(os.environ.get("POSTGRES_POOL_IDLE"))
+        }
+
+    @staticmethod
+    def get_audio_cache_size() -> int:
+        """Returns the memory budget of the audio frame cache in bytes
+        """
+        return int(float(os.environ.get("AUDIO_CACHE_MB")) * 1024 * 1024)
+
     @staticmethod
     def get_discord_token() -> str:
         """Returns discord token
@@ -1,10 +1,15 @@
 # default
+import csv
+import hashlib
+import io
 import logging
 import os
 import time
 import discord
 # pip
 import psycopg2
+import psycopg2.errors
+import psycopg2.extras
 from psycopg2.extensions import connection
 # internal
 from . import config
@@ -44,18 +49,19 @@ class Database:
         """
         if server_id is None:
             with conn.cursor() as cur:
-                cur.execute("SELECT server_id,servername,language,play_maxlen FROM discord_servers")
+                cur.execute("SELECT server_id,servername,language,play_maxlen,play_queue FROM discord_servers")
                 db_result = cur.fetchall()
             return [{
                 'server_id': row[0],
                 'servername': row[1],
                 'language': row[2],
-                'play_maxlen': row[3]
+                'play_maxlen': row[3],
+                'play_queue': row[4]
             } for row in db_result]
 
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT server_id,servername,language,play_maxlen FROM discord_servers " +
+                "SELECT server_id,servername,language,play_maxlen,play_queue FROM discord_servers " +
                 "WHERE (server_id=%(server_id)s);",
                 {'server_id': server_id}
             )
@@ -66,7 +72,8 @@ class Database:
             'server_id': server_id,
             'servername': db_result[0][1],
             'language': db_result[0][2],
-            'play_maxlen': db_result[0][3]
+            'play_maxlen': db_result[0][3],
+            'play_queue': db_result[0][4]
         }
 
     @staticmethod
@@ -79,7 +86,9 @@ class Database:
                 "INSERT INTO discord_servers (server_id,servername) " +
                 "VALUES (%(server_id)s,%(name)s) " +
                 "ON CONFLICT (server_id) DO UPDATE " +
-                "SET servername = %(name)s;",
+                "SET servername = excluded.servername " +
+                # an unchanged name isn't written, which would notify the sound catalog for nothing
+                "WHERE discord_servers.servername IS DISTINCT FROM excluded.servername;",
                 {'server_id': server_id, 'name': name}
             )
         return
@@ -91,7 +100,7 @@ class Database:
                 "SELECT group_name FROM discord_server_admin_groups WHERE server_id=%(server_id)s",
                 {'server_id': server_id}
             )
-        return [x[0] for x in cur.fetchall()]
+            return [x[0] for x in cur.fetchall()]
 
     @staticmethod
     def add_admin_group(conn: connection, server_id: int, group_name: str) -> int:
@@ -150,28 +159,80 @@ class Database:
             )
         return
 
+    @staticmethod
+    def set_play_queue(conn: connection, server_id: int, depth: int):
+        """Sets how many sounds can be queued behind the playing one, 0 disables the queue
+        """
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE discord_servers " +
+                "SET play_queue = %(play_queue)s " +
+                "WHERE server_id = %(server_id)s;",
+                {'play_queue': depth, 'server_id': server_id}
+            )
+        return
+
     # -- "private" functions
 
     @staticmethod
     def __ensure_tables(conn: connection):
-        """Executes all sql files provided in data/schemas, starting with base.sql
+        """Executes the sql files in data/schemas which are new or changed since they were last applied,
+        starting with base.sql. Applied files are tracked with their checksum in schema_migrations.
         """
-        schema_folder = config.Config().folders["data"].joinpath("schemas")
+        migrations = Database.__read_migrations()
+
+        if not Database.__pending_migrations(conn, migrations):
+            logging.info("Database schema is up-to-date.")
+            return
 
-        # create base schema
-        logging.info("Recreating database schema '%s'", "base.sql")
         with conn.cursor() as cur:
-            cur.execute(open(schema_folder.joinpath("base.sql"), "r").read())
+            # serialize concurrently starting instances, released on commit
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('gustelbot_schema_migrations'));")
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS schema_migrations(" +
+                "version TEXT PRIMARY KEY, " +
+                "checksum TEXT NOT NULL, " +
+                "applied_at TIMESTAMPTZ NOT NULL DEFAULT now());"
+            )
+        # another instance might have applied them while waiting for the lock
+        for version, sql, checksum in Database.__pending_migrations(conn, migrations):
+            logging.info("Applying database schema '%s'", version)
+            with conn.cursor() as cur:
+                cur.execute(sql)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version,checksum) VALUES (%(version)s,%(checksum)s) " +
+                    "ON CONFLICT (version) DO UPDATE " +
+                    "SET checksum = %(checksum)s, applied_at = now();",
+                    {'version': version, 'checksum': checksum}
+                )
 
-        # create all other schemas
-        schemas = [x for x in os.listdir(schema_folder) if x != "base.sql" and x.endswith(".sql")]
+    @staticmethod
+    def __read_migrations() -> list[tuple[str, str, str]]:
+        """Returns (version, sql, checksum) of all sql files in data/schemas, base.sql first
+        """
+        schema_folder = config.Config().folders["data"].joinpath("schemas")
+        schemas = sorted(x for x in os.listdir(schema_folder) if x != "base.sql" and x.endswith(".sql"))
 
-        for schema in schemas:
-            logging.info("Recreating database schema '%s'", schema)
-            current_path = schema_folder.joinpath(schema)
+        migrations = []
+        for schema in ["base.sql"] + schemas:
+            sql = schema_folder.joinpath(schema).read_text()
+            migrations.append((schema, sql, hashlib.sha256(sql.encode()).hexdigest()))
+        return migrations
 
+    @staticmethod
+    def __pending_migrations(
+            conn: connection, migrations: list[tuple[str, str, str]]
+    ) -> list[tuple[str, str, str]]:
+        """Returns migrations which were not applied yet or whose file changed since
+        """
+        try:
             with conn.cursor() as cur:
-                cur.execute(open(current_path, "r").read())
+                cur.execute("SELECT version,checksum FROM schema_migrations;")
+                applied = dict(cur.fetchall())
+        except psycopg2.errors.UndefinedTable:
+            conn.rollback()
+            applied = {}
+        return [x for x in migrations if applied.get(x[0]) != x[2]]
 
 
 class Brotato:
@@ -351,8 +412,9 @@ class FileCon:
         with conn.cursor() as cur:
             cur.execute(
                 "insert into files (file_size, server_id, uploader_id, display_name, file_name, file_hash, seconds, "
-                "deleted) values (%(size)s, %(server_id)s, %(uploader_id)s, %(display_name)s, %(name)s, %(hash)s, "
-                "%(seconds)s, %(deleted)s) returning file_id",
+                "deleted, loudness, true_peak, loudness_range) values (%(size)s, %(server_id)s, %(uploader_id)s, "
+                "%(display_name)s, %(name)s, %(hash)s, %(seconds)s, %(deleted)s, %(loudness)s, %(true_peak)s, "
+                "%(loudness_range)s) returning file_id",
                 {
                     "size": file.size,
                     "server_id": file.guild_id,
@@ -362,14 +424,25 @@ class FileCon:
                     "hash": file.file_hash,
                     "seconds": file.seconds,
                     "deleted": False,
+                    "loudness": file.loudness,
+                    "true_peak": file.true_peak,
+                    "loudness_range": file.loudness_range,
                 }
             )
             file_id = cur.fetchone()[0]
         if file.tags:
+            FileCon.link_tags(conn, file_id, [x for x in file.tags if isinstance(x, str) and not x.isdigit()])
             for tag in file.tags:
-                FileCon.link_tag(conn, file_id, tag)
+                if isinstance(tag, int) or tag.isdigit():
+                    FileCon.link_tag(conn, file_id, tag)
         return file_id
 
+    # columns of the files table, usable as get_file() filters
+    columns = frozenset({
+        'file_id', 'file_size', 'server_id', 'uploader_id', 'display_name', 'file_name', 'file_hash', 'public',
+        'seconds', 'deleted', 'deletion_date', 'loudness', 'true_peak', 'loudness_range'
+    })
+
     @staticmethod
     def get_file(conn: connection, **kwargs) -> list[dataclasses.File]:
         """
@@ -378,22 +451,46 @@ class FileCon:
         (file_id, size, server_id, uploader_id, display_name, file_name, hash, public)
         """
         # Check if provided kwargs are valid use cases
-        with conn.cursor() as cur:
-            cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'files'")
-            columns = [x[0] for x in cur.fetchall()]
-
         query = ""
         for key, value in kwargs.items():
-            if key not in columns:
+            if key not in FileCon.columns:
                 raise TypeError(f"Unexpected keyword argument '{key}'")
             query = FileCon.__build_argument(key, query)
 
-        # build SQL request
+        return FileCon.__select_files(conn, query, kwargs)
+
+    @staticmethod
+    def get_files_by_id(conn: connection, file_ids: list[int]) -> list[dataclasses.File]:
+        """
+        Returns all requested files in one query, including deleted ones.
+        """
+        return FileCon.__select_files(conn, "WHERE files.file_id = ANY(%(file_ids)s)", {'file_ids': list(file_ids)})
+
+    @staticmethod
+    def get_files_by_name(conn: connection, file_names: list[str]) -> list[dataclasses.File]:
+        """
+        Returns all files with one of the given file names in one query, including deleted ones.
+        """
+        return FileCon.__select_files(
+            conn, "WHERE files.file_name = ANY(%(file_names)s)", {'file_names': list(file_names)}
+        )
+
+    @staticmethod
+    def __select_files(conn: connection, query: str, params: dict) -> list[dataclasses.File]:
+        """
+        Selects files including their tag names, query is appended as WHERE clause.
+        """
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT file_id,file_size,server_id,uploader_id,display_name,file_name,file_hash, "
-                "seconds FROM files " + query,
-                kwargs
+                "SELECT files.file_id,file_size,server_id,uploader_id,display_name,file_name,file_hash, "
+                "seconds,deleted,loudness,true_peak,loudness_range,"
+                "COALESCE(array_agg(t.tag_name ORDER BY t.tag_name) FILTER (WHERE t.tag_name IS NOT NULL), '{}') "
+                "FROM files "
+                "LEFT JOIN files_tags ft ON ft.file_id = files.file_id "
+                "LEFT JOIN tags t ON t.tag_id = ft.tag_id " +
+                query +
+                " GROUP BY files.file_id",
+                params
             )
             db_result = cur.fetchall()
         files = []
@@ -408,11 +505,172 @@ class FileCon:
                     file_name=row[5],
                     file_hash=row[6],
                     seconds=row[7],
-                    tags=()  # TODO fetch tags
+                    deleted=row[8],
+                    loudness=row[9],
+                    true_peak=row[10],
+                    loudness_range=row[11],
+                    tags=tuple(row[12])
                 )
             )
         return files
 
+    @staticmethod
+    def get_name_page(
+            conn: connection,
+            limit: int,
+            after: tuple[str, int] | None = None,
+            before: tuple[str, int] | None = None,
+            tag: str | None = None,
+            uploader_id: int | None = None
+    ) -> list[tuple[str, int]]:
+        """
+        Returns up to limit (display_name, file_id) of visible files ordered by name, after or before the given key.
+        Keyset pagination on files_visible_display_name_idx, every page costs the same regardless of its position.
+        Tags are matched case-insensitively, like the catalog does.
+        """
+        query = "SELECT display_name,file_id FROM files WHERE NOT deleted"
+        if after is not None:
+            query += " AND (display_name, file_id) > (%(name)s, %(file_id)s)"
+        elif before is not None:
+            query += " AND (display_name, file_id) < (%(name)s, %(file_id)s)"
+        if uploader_id is not None:
+            query += " AND uploader_id = %(uploader_id)s"
+        if tag is not None:
+            query += (
+                " AND EXISTS (SELECT 1 FROM files_tags ft JOIN tags t ON t.tag_id = ft.tag_id "
+                "WHERE ft.file_id = files.file_id AND lower(t.tag_name) = lower(%(tag)s))"
+            )
+        # pages before the key are read backwards from it
+        order = "DESC" if after is None and before is not None else "ASC"
+        query += f" ORDER BY display_name {order}, file_id {order} LIMIT %(limit)s"
+        key = after or before or (None, None)
+        with conn.cursor() as cur:
+            cur.execute(
+                query,
+                {'name': key[0], 'file_id': key[1], 'uploader_id': uploader_id, 'tag': tag, 'limit': limit}
+            )
+            rows = cur.fetchall()
+        return rows[::-1] if order == "DESC" else rows
+
+    @staticmethod
+    def get_existing_hashes(conn: connection, file_hashes: list[str]) -> set[str]:
+        """
+        Returns which of the given hashes are already stored, including deleted files.
+        """
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT DISTINCT file_hash FROM files WHERE file_hash = ANY(%(hashes)s)", {'hashes': file_hashes}
+            )
+            return {x[0] for x in cur.fetchall()}
+
+    @staticmethod
+    def get_display_names(conn: connection) -> set[str]:
+        """
+        Returns the display names of all files, including deleted ones.
+        """
+        with conn.cursor() as cur:
+            cur.execute("SELECT DISTINCT display_name FROM files")
+            return {x[0] for x in cur.fetchall()}
+
+    @staticmethod
+    def copy_files(conn: connection, files: list[dataclasses.File]) -> list[int]:
+        """
+        Adds many files including their tags with COPY instead of one INSERT per row, returns the new file ids.
+        The ids are reserved from the sequence first, so tags can be linked without reading the rows back.
+        """
+        if not files:
+            return []
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT nextval(pg_get_serial_sequence('files', 'file_id')) FROM generate_series(1, %(count)s)",
+                {'count': len(files)}
+            )
+            file_ids = [x[0] for x in cur.fetchall()]
+            for file, file_id in zip(files, file_ids):
+                file.id = file_id
+            cur.copy_expert(
+                "COPY files (file_id,file_size,server_id,uploader_id,display_name,file_name,file_hash,seconds,"
+                "deleted,loudness,true_peak,loudness_range) FROM STDIN "
+                "WITH (FORMAT csv, FORCE_NOT_NULL (display_name,file_name,file_hash))",
+                FileCon.__csv([
+                    (x.id, x.size, x.guild_id, x.user_id, x.display_name, x.file_name, x.file_hash, x.seconds,
+                     False, x.loudness, x.true_peak, x.loudness_range)
+                    for x in files
+                ])
+            )
+            links = [(x.id, tag) for x in files for tag in dict.fromkeys(x.tags or ())]
+            if not links:
+                return file_ids
+            # tags are staged in a temporary table, so existing ones are reused and new ones created in one go
+            cur.execute("CREATE TEMPORARY TABLE import_tags (file_id bigint, tag_name text)")
+            cur.copy_expert(
+                "COPY import_tags (file_id,tag_name) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (tag_name))",
+                FileCon.__csv(links)
+            )
+            cur.execute(
+                "INSERT INTO tags (tag_name) SELECT DISTINCT tag_name FROM import_tags "
+                "ON CONFLICT (tag_name) DO NOTHING"
+            )
+            cur.execute(
+                "INSERT INTO files_tags (file_id,tag_id) "
+                "SELECT i.file_id, t.tag_id FROM import_tags i JOIN tags t ON t.tag_name = i.tag_name "
+                "ON CONFLICT DO NOTHING"
+            )
+            cur.execute("DROP TABLE import_tags")
+        return file_ids
+
+    @staticmethod
+    def __csv(rows: list[tuple]) -> io.StringIO:
+        """
+        Returns rows as csv for COPY, None becomes NULL.
+        """
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        return buffer
+
+    @staticmethod
+    def set_loudness(conn: connection, measurements: list[tuple[int, float, float, float]]):
+        """
+        Stores loudness measurements of multiple files in one statement,
+        takes (file_id, loudness, true_peak, loudness_range) tuples.
+        """
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(
+                cur,
+                "UPDATE files SET loudness = v.loudness, true_peak = v.true_peak, " +
+                "loudness_range = v.loudness_range " +
+                "FROM (VALUES %s) AS v (file_id,loudness,true_peak,loudness_range) " +
+                "WHERE files.file_id = v.file_id;",
+                measurements,
+                template="(%s,%s::real,%s::real,%s::real)"
+            )
+
+    @staticmethod
+    def rename_files(conn: connection, renames: list[tuple[int, str]]):
+        """
+        Changes the file name of multiple files in one statement, takes (file_id, file_name) tuples.
+        """
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(
+                cur,
+                "UPDATE files SET file_name = v.file_name " +
+                "FROM (VALUES %s) AS v (file_id,file_name) " +
+                "WHERE files.file_id = v.file_id;",
+                renames
+            )
+
+    @staticmethod
+    def set_deleted(conn: connection, file_ids: list[int], deleted: bool):
+        """
+        Marks multiple files as deleted or restored in one statement.
+        """
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE files SET deleted = %(deleted)s, deletion_date = now() WHERE file_id = ANY(%(file_ids)s)",
+                {'file_ids': list(file_ids), 'deleted': deleted}
+            )
+
     @staticmethod
     def mark_file_deleted(db_con, file_id: int, deleted: bool):
         """
@@ -433,10 +691,10 @@ class FileCon:
         Creates additional WHERE statements in order for query to be somewhat dynamic
         """
         if query:
-            query += f" AND {keyword} = %({keyword})s"
+            query += f" AND files.{keyword} = %({keyword})s"
             return query
         else:
-            return f"WHERE {keyword} = %({keyword})s"
+            return f"WHERE files.{keyword} = %({keyword})s"
 
     @staticmethod
     def add_tag(conn: connection, tag_name: str) -> int:
@@ -476,20 +734,37 @@ class FileCon:
     @staticmethod
     def link_tag(conn: connection, file_id: int, tag: int | str):
         """
-        Links tag to file. If both id and name are set id takes priority.
+        Links tag to file, by id if tag is a number, otherwise by name.
         Creates tags if they don't exist yet.
         """
-        if not FileCon.get_file(conn, file_id=file_id):
-            raise Exception("Requested file does not exist!")
+        if isinstance(tag, str) and not tag.isdigit():
+            FileCon.link_tags(conn, file_id, [tag])
+            return
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO files_tags (file_id,tag_id) VALUES (%(file_id)s,%(tag)s) ON CONFLICT DO NOTHING",
+                {"file_id": file_id, "tag": int(tag)}
+            )
 
-        # create tag in db if it doesn't exist already
-        if not (db_tag := FileCon.get_tag(conn, tag)) and isinstance(tag, str):
-            db_tag = (FileCon.add_tag(conn, tag), tag)
-        # TODO: fix this! fix what??
+    @staticmethod
+    def link_tags(conn: connection, file_id: int, tag_names: list[str]):
+        """
+        Links all tags to file in one statement, tags which don't exist yet are created.
+        A file that does not exist violates the foreign key.
+        """
+        # a row can only be upserted once per statement
+        tag_names = list(dict.fromkeys(tag_names))
+        if not tag_names:
+            return
         with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO files_tags (file_id,tag_id) VALUES (%(file_id)s,%(tag)s)",
-                {"file_id": file_id, "tag": db_tag[0]}
+                "WITH linked AS ("
+                "INSERT INTO tags (tag_name) SELECT unnest(%(tag_names)s::text[]) "
+                "ON CONFLICT (tag_name) DO UPDATE SET tag_name = EXCLUDED.tag_name "
+                "RETURNING tag_id) "
+                "INSERT INTO files_tags (file_id,tag_id) SELECT %(file_id)s, tag_id FROM linked "
+                "ON CONFLICT DO NOTHING",
+                {"file_id": file_id, "tag_names": tag_names}
             )
 
 
@@ -511,6 +786,20 @@ class User:
                 {'id': user_id, 'name': user_name}
             )
 
+    @staticmethod
+    def add_users(conn: connection, users: list[tuple[int, str]]):
+        """
+        Adds or updates multiple users in one statement, takes (user_id, name) tuples.
+        """
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO discord_users (user_id,name) VALUES %s " +
+                "ON CONFLICT (user_id) DO UPDATE " +
+                "SET name = EXCLUDED.name;",
+                users
+            )
+
     @staticmethod
     def delete_user(conn: connection, user_id: str):
         pass
@@ -559,6 +848,27 @@ class User:
                 {'user_id': user_id, 'server_id': server_id, 'displayname': name}
             )
 
+    @staticmethod
+    def add_user_display_names(conn: connection, names: list[tuple[int, int, str]]) -> list[tuple[int, int]]:
+        """
+        Adds or updates multiple display names in one statement, takes (user_id, server_id, displayname) tuples.
+        Rows of servers which are not in the database are skipped.
+        Returns (user_id, server_id) of the written rows.
+        """
+        with conn.cursor() as cur:
+            return psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO discord_user_displaynames (user_id,server_id,displayname) " +
+                "SELECT v.user_id,v.server_id,v.displayname " +
+                "FROM (VALUES %s) AS v (user_id,server_id,displayname) " +
+                "INNER JOIN discord_servers ds ON ds.server_id = v.server_id " +
+                "ON CONFLICT (user_id,server_id) DO UPDATE " +
+                "SET displayname = EXCLUDED.displayname " +
+                "RETURNING user_id,server_id;",
+                names,
+                fetch=True
+            )
+
     @staticmethod
     def user_ensure(conn: connection, user: discord.Member):
         """
@@ -14,6 +14,10 @@ class File:
     seconds
     tags
     id
+    deleted
+    loudness: integrated loudness in LUFS, None if not measured yet
+    true_peak: in dBTP
+    loudness_range: in LU
     """
     size: int
     guild_id: int
@@ -24,3 +28,22 @@ class File:
     seconds: int
     tags: tuple = ()
     id: int = None
+    deleted: bool = False
+    loudness: float = None
+    true_peak: float = None
+    loudness_range: float = None
+
+
+@dataclass
+class Probe:
+    """
+    Information about an audio file which requires reading it.
+    md5
+    seconds: None if it isn't a readable audio file
+    codec: mime type reported by mutagen
+    sample_rate
+    """
+    md5: str
+    seconds: float | None = None
+    codec: str | None = None
+    sample_rate: int | None = None
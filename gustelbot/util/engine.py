@@ -0,0 +1,326 @@
+# default
+import asyncio
+import collections
+import contextlib
+import functools
+import logging
+import time
+import typing
+import weakref
+# pip
+import psycopg2
+from psycopg2.extensions import connection
+# internal
+from . import config
+from . import database
+
+
+class Engine:
+    """
+    Bounded pool of postgres connections, usable from the event loop.
+    Queries are executed on worker threads so a slow query never blocks the bot.
+
+    async with engine.connection() as db:
+        files = await db.file.get_file(deleted=False)
+
+    Leaving the 'async with' block commits, an exception rolls back.
+    """
+    def __init__(
+            self,
+            min_size: int = 1,
+            max_size: int = 10,
+            max_idle: float = 300.0,
+            check_after: float = 30.0
+    ):
+        """
+        min_size: connections kept open even when idle
+        max_size: upper bound of open connections, further requests wait
+        max_idle: seconds after which surplus idle connections are closed
+        check_after: idle seconds after which a connection is pinged before reuse
+        """
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+        self.logger = logging.getLogger(__name__)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.check_after = check_after
+        # idle connections with the time they were returned, most recently used last
+        self._idle: collections.deque[tuple[connection, float]] = collections.deque()
+        self._size = 0
+        self._cond: asyncio.Condition | None = None
+        self._reaper: asyncio.Task | None = None
+        self._closed = False
+        # one unit of work per interaction context
+        self._units: weakref.WeakKeyDictionary[typing.Any, UnitOfWork] = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def from_config(cls, settings: config.Config) -> 'Engine':
+        pool = settings.get_pool_config()
+        return cls(min_size=pool['min'], max_size=pool['max'], max_idle=pool['idle'])
+
+    @property
+    def size(self) -> int:
+        """Number of currently open connections"""
+        return self._size
+
+    async def open(self):
+        """
+        Opens min_size connections and starts reaping idle ones. Safe to call repeatedly.
+        """
+        self._closed = False
+        while self._size < self.min_size:
+            self._size += 1
+            try:
+                conn = await asyncio.to_thread(database.Database.new_connection)
+            except Exception:
+                self._size -= 1
+                raise
+            await self.release(conn)
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self.__reap())
+
+    async def close(self):
+        """
+        Closes all idle connections, connections in use are closed once released.
+        """
+        self._closed = True
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        async with self.__condition():
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self.__discard(conn)
+            self._cond.notify_all()
+
+    async def acquire(self) -> connection:
+        """
+        Returns a healthy connection, waits if max_size connections are in use.
+        Every acquired connection has to be given back using release().
+        """
+        if self._closed:
+            raise RuntimeError("Engine is closed")
+        while True:
+            async with self.__condition():
+                while not self._idle and self._size >= self.max_size:
+                    await self._cond.wait()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    # reserve the slot, connecting happens outside the lock
+                    self._size += 1
+                    conn = None
+            if conn is None:
+                try:
+                    return await asyncio.to_thread(database.Database.new_connection)
+                except Exception:
+                    async with self.__condition():
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            if not conn.closed:
+                if time.monotonic() - last_used <= self.check_after:
+                    return conn
+                if await asyncio.to_thread(Engine.__ping, conn):
+                    return conn
+                self.logger.info("Dropping broken database connection.")
+            async with self.__condition():
+                self.__discard(conn)
+                self._cond.notify()
+
+    async def release(self, conn: connection, discard: bool = False):
+        """
+        Hands connection back to the pool. Open transactions are rolled back.
+        """
+        if not conn.closed and not discard and conn.status != psycopg2.extensions.STATUS_READY:
+            try:
+                await asyncio.to_thread(conn.rollback)
+            except psycopg2.Error:
+                discard = True
+        async with self.__condition():
+            if discard or conn.closed or self._closed:
+                self.__discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextlib.asynccontextmanager
+    async def connection(self) -> typing.AsyncIterator['AsyncConnection']:
+        """
+        Borrows a connection for the duration of the block, commits on success.
+        """
+        conn = await self.acquire()
+        broken = False
+        try:
+            db = AsyncConnection(conn)
+            yield db
+            await db.commit()
+        except BaseException:
+            try:
+                await asyncio.to_thread(conn.rollback)
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            await self.release(conn, discard=broken)
+
+    def unit_of_work(self, ctx) -> 'UnitOfWork':
+        """
+        Returns the unit of work bound to ctx, creating it on first use.
+        Everything handling the same interaction shares its connection and transaction.
+        """
+        if (uow := self._units.get(ctx)) is None:
+            uow = self._units[ctx] = UnitOfWork(self)
+        return uow
+
+    async def finish(self, ctx, commit: bool = True):
+        """
+        Commits (or rolls back) the unit of work bound to ctx and returns its connection to the pool.
+        """
+        if (uow := self._units.pop(ctx, None)) is not None:
+            await uow.close(commit)
+
+    # -- "private" functions
+
+    def __condition(self) -> asyncio.Condition:
+        # created lazily, so the engine can be built before the event loop runs
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def __discard(self, conn: connection):
+        self._size -= 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    async def __reap(self):
+        """
+        Closes connections which have been idle for longer than max_idle, keeping min_size open.
+        """
+        while True:
+            await asyncio.sleep(max(self.max_idle / 2, 1))
+            now = time.monotonic()
+            async with self.__condition():
+                # oldest connections are at the left of the deque
+                while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.max_idle:
+                    conn, _ = self._idle.popleft()
+                    self.__discard(conn)
+                    self.logger.debug("Closed idle database connection, %s left.", self._size)
+
+    @staticmethod
+    def __ping(conn: connection) -> bool:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+class AsyncConnection:
+    """
+    Awaitable access to the methods of the database classes, bound to one pooled connection.
+        await db.database.get_server(server_id=1)
+        await db.file.get_file(deleted=False)
+        await db.brotato.get_brotato_char("Brotato")
+        await db.user.get_user(user_id)
+    """
+    def __init__(self, conn: connection):
+        self.raw = conn
+        self.database = AsyncProxy(self, database.Database)
+        self.file = AsyncProxy(self, database.FileCon)
+        self.brotato = AsyncProxy(self, database.Brotato)
+        self.user = AsyncProxy(self, database.User)
+
+    async def run(self, func: typing.Callable, *args, **kwargs):
+        """
+        Executes func(conn, *args, **kwargs) on a worker thread.
+        """
+        return await asyncio.to_thread(func, self.raw, *args, **kwargs)
+
+    async def commit(self):
+        await asyncio.to_thread(self.raw.commit)
+
+    async def rollback(self):
+        await asyncio.to_thread(self.raw.rollback)
+
+
+class UnitOfWork:
+    """
+    One transaction shared by all code handling a single interaction, see Engine.unit_of_work().
+    The connection is only taken from the pool once the first query is issued.
+    Offers the same awaitable methods as AsyncConnection.
+    """
+    def __init__(self, engine: Engine):
+        self._engine = engine
+        self._conn: AsyncConnection | None = None
+        self._lock = asyncio.Lock()
+        self.database = AsyncProxy(self, database.Database)
+        self.file = AsyncProxy(self, database.FileCon)
+        self.brotato = AsyncProxy(self, database.Brotato)
+        self.user = AsyncProxy(self, database.User)
+
+    async def connection(self) -> AsyncConnection:
+        async with self._lock:
+            if self._conn is None:
+                self._conn = AsyncConnection(await self._engine.acquire())
+            return self._conn
+
+    async def run(self, func: typing.Callable, *args, **kwargs):
+        return await (await self.connection()).run(func, *args, **kwargs)
+
+    async def commit(self):
+        """
+        Commits early, e.g. before reporting success of a write to the user.
+        """
+        if self._conn is not None:
+            await self._conn.commit()
+
+    async def release(self):
+        """
+        Commits and returns the connection to the pool before slow work without database access,
+        the next query takes a connection again.
+        """
+        await self.close()
+
+    async def close(self, commit: bool = True):
+        async with self._lock:
+            if self._conn is None:
+                return
+            conn, self._conn = self._conn, None
+        broken = False
+        try:
+            if commit:
+                await conn.commit()
+            else:
+                await conn.rollback()
+        except psycopg2.Error:
+            logging.getLogger(__name__).error("Failed to finish unit of work", exc_info=True)
+            broken = conn.raw.closed != 0
+            raise
+        finally:
+            await self._engine.release(conn.raw, discard=broken)
+
+
+class AsyncProxy:
+    """
+    Turns the static methods of a database class into coroutines, the connection is passed automatically.
+    """
+    # methods which do not take a connection as first argument
+    _unbound = {'new_connection'}
+
+    def __init__(self, owner, cls: type):
+        self._owner = owner
+        self._cls = cls
+
+    def __getattr__(self, name: str):
+        if name.startswith('_') or name in self._unbound:
+            raise AttributeError(f"'{self._cls.__name__}' has no awaitable method '{name}'")
+        func = getattr(self._cls, name)
+        if not callable(func):
+            raise AttributeError(f"'{self._cls.__name__}.{name}' is not a method")
+        return functools.partial(self._owner.run, func)
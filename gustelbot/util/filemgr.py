@@ -1,43 +1,74 @@
 # default
 import hashlib
 import logging
+import os
 import pathlib
 import random
 import shutil
 from difflib import SequenceMatcher
+from typing import Iterator
 # pip
 import mutagen
 # internal
+from . import probecache
+
+# files with other extensions (cover images, notes) are never chosen as random sounds
+AUDIO_SUFFIXES = frozenset({".aac", ".flac", ".m4a", ".mp3", ".ogg", ".opus", ".wav", ".webm", ".wma"})
+
+
+def walk_files(folder: pathlib.Path) -> Iterator[pathlib.Path]:
+    """
+    Yields all files in folder and its sub-folders, one directory is read at a time.
+    """
+    stack = [folder]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    # scandir already knows the type of most entries, no stat() needed
+                    if entry.is_file():
+                        yield pathlib.Path(entry.path)
+                    elif entry.is_dir(follow_symlinks=False):
+                        stack.append(pathlib.Path(entry.path))
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
 
 
 def get_files_rec(folder: pathlib.Path) -> list[pathlib.Path]:
     """
-    Returns list of tuples, format: (path, filename)
+    Returns list of all files in folder and its sub-folders
     """
     if folder.is_file():
         logging.error("File instead of folder provided!")
         return []
-    found_files = []
-    for file in folder.iterdir():
-        if file.is_file():
-            found_files.append(file)
-            continue
-        if file.is_dir():
-            found_files += get_files_rec(file)
-    return found_files
+    return list(walk_files(folder))
 
 
-def get_random_file(folder: pathlib.Path, max_len: int) -> pathlib.Path:
+def get_random_file(folder: pathlib.Path, max_len: int) -> pathlib.Path | None:
     """
-    Returns random file from folder, if max_len is 0 ignore max_len
+    Returns random audio file from folder, if max_len is 0 ignore max_len.
+    The folder is walked once without keeping a file list (reservoir sampling),
+    audio files are told apart by their extension, lengths come from the probe cache and are only read
+    if max_len is set.
     """
-    files = get_files_rec(folder)
-    files_clean = []
-    for file in files:
-        sound_len = get_sound_length(file)
-        if sound_len and max_len == 0 or sound_len <= max_len:
-            files_clean.append(file)
-    return random.choice(files_clean)
+    cache = probecache.default() if max_len else None
+    chosen = None
+    count = 0
+    for file in walk_files(folder):
+        if file.suffix.lower() not in AUDIO_SUFFIXES:
+            continue
+        if cache is not None:
+            try:
+                sound_len = cache.seconds(file)
+            except OSError:
+                continue
+            if sound_len is None or sound_len > max_len:
+                continue
+        count += 1
+        # the n-th suitable file replaces the choice with probability 1/n, every file ends up equally likely
+        if random.randrange(count) == 0:
+            chosen = file
+    return chosen
 
 
 def get_sound_length(file: pathlib.Path) -> int | None:
@@ -60,8 +91,15 @@ def get_folders(path: pathlib.Path) -> list[pathlib.Path]:
 
 def search_files(lst: list[pathlib.Path], keyword: str, threshhold=0.65) -> pathlib.Path | None:
     result_list = []
+    matcher = SequenceMatcher()
+    # SequenceMatcher caches information about the second sequence, so it's reused for every file
+    matcher.set_seq2(keyword.lower())
     for item in lst:
-        ratio = SequenceMatcher(None, item.name.lower(), keyword.lower()).ratio()
+        matcher.set_seq1(item.name.lower())
+        # cheap upper bounds of ratio() skip most files
+        if matcher.real_quick_ratio() < threshhold or matcher.quick_ratio() < threshhold:
+            continue
+        ratio = matcher.ratio()
         if ratio >= threshhold:
             result_list.append((item, ratio))
     result_list.sort(key=lambda x: x[1], reverse=True)
@@ -0,0 +1,185 @@
+# default
+import asyncio
+import logging
+import math
+import os
+import pathlib
+# pip
+from psycopg2.extensions import connection
+# internal
+from . import dataclasses
+from . import filemgr
+from . import loudness
+from . import probecache
+from . import storage
+from . import transcode
+from .database import Database
+from .database import FileCon
+from .database import User
+
+
+class ImporterError(Exception):
+    """
+    Import can't be started, the message can be shown to the user.
+    """
+
+
+class Importer:
+    """
+    Adds a whole folder of sounds to the database without going through Discord.
+    Files are hashed and probed in worker processes, duplicates of stored sounds are skipped,
+    and each batch is written with COPY in its own transaction, so an interrupted import can simply be repeated.
+    The display name is the file name without extension, made unique with a number if needed.
+    """
+    def __init__(
+            self,
+            sound_folder: pathlib.Path,
+            opus_folder: pathlib.Path,
+            server_id: int | None = None,
+            uploader_id: int | None = None,
+            tags: tuple[str, ...] = (),
+            folder_tags: bool = True,
+            normalize: bool = False,
+            workers: int | None = None,
+            batch_size: int = 1000
+    ):
+        """
+        server_id/uploader_id: owner of the imported sounds, None for global sounds
+        tags: added to every imported sound
+        folder_tags: tag sounds with the names of the sub-folders they are in
+        normalize: measure loudness and transcode with ffmpeg while importing, otherwise the bot does it later
+        workers: processes for hashing and ffmpeg, defaults to the cpu count
+        """
+        self.logger = logging.getLogger(__name__)
+        self.sound_folder = sound_folder
+        self.opus_folder = opus_folder
+        self.server_id = server_id
+        self.uploader_id = uploader_id
+        self.tags = tuple(tags)
+        self.folder_tags = folder_tags
+        self.normalize = normalize
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+
+    def run(self, folder: pathlib.Path) -> int:
+        """
+        Imports all audio files below folder, returns the amount of imported sounds.
+        Raises ImporterError before touching any file if the server or uploader is unknown.
+        """
+        conn = Database.new_connection()
+        try:
+            Database.check(conn)
+            conn.commit()
+            self.__validate(conn)
+            candidates = self.__probe(folder)
+            existing = FileCon.get_existing_hashes(conn, list(candidates))
+            names = FileCon.get_display_names(conn)
+            conn.commit()
+            todo = [x for md5, x in candidates.items() if md5 not in existing]
+            self.logger.info(f"Importing {len(todo)} new sounds, {len(candidates) - len(todo)} are stored already.")
+            imported = 0
+            for start in range(0, len(todo), self.batch_size):
+                imported += self.__import_batch(conn, folder, todo[start:start + self.batch_size], names)
+                self.logger.info(f"Imported {imported}/{len(todo)} sounds.")
+        finally:
+            conn.close()
+        return imported
+
+    # -- "private" functions
+
+    def __validate(self, conn: connection):
+        """
+        Checks that the owner of the sounds exists, the rows would violate their foreign keys otherwise.
+        """
+        if self.server_id is not None and Database.get_server(conn, self.server_id) is None:
+            raise ImporterError(f"Unknown server {self.server_id}, the bot has to be on it first.")
+        if self.uploader_id is not None and User.get_user(conn, self.uploader_id) is None:
+            raise ImporterError(f"Unknown uploader {self.uploader_id}, the bot has to have seen them first.")
+        conn.commit()
+
+    def __probe(self, folder: pathlib.Path) -> dict[str, tuple[pathlib.Path, dataclasses.Probe]]:
+        """
+        Returns md5 -> (file, probe) of the readable audio files below folder, the first file of duplicates.
+        """
+        files = list(filemgr.walk_files(folder))
+        self.logger.info(f"Found {len(files)} files in {folder}.")
+
+        def progress(done: int, total: int):
+            self.logger.info(f"Probed {done}/{total} files.")
+
+        probes = probecache.default().probe_many(files, self.workers, progress)
+        candidates = {}
+        for file in files:
+            probe = probes.get(file)
+            if probe is None or probe.seconds is None:
+                self.logger.warning(f"Skipping {file}, it is not a readable audio file.")
+                continue
+            candidates.setdefault(probe.md5, (file, probe))
+        return candidates
+
+    def __create_file(
+            self, folder: pathlib.Path, file: pathlib.Path, probe: dataclasses.Probe, names: set[str]
+    ) -> dataclasses.File:
+        name = file.stem
+        number = 2
+        while name in names:
+            name = f"{file.stem} {number}"
+            number += 1
+        names.add(name)
+        tags = list(self.tags)
+        if self.folder_tags:
+            tags += file.relative_to(folder).parent.parts
+        return dataclasses.File(
+            size=file.stat().st_size,
+            guild_id=self.server_id,
+            user_id=self.uploader_id,
+            display_name=name,
+            file_name=file.name,
+            file_hash=probe.md5,
+            seconds=math.floor(probe.seconds),
+            tags=tuple(x.strip() for x in tags if x.strip() and not x.strip().isdigit() and ',' not in x)
+        )
+
+    def __import_batch(
+            self, conn: connection, folder: pathlib.Path,
+            batch: list[tuple[pathlib.Path, dataclasses.Probe]], names: set[str]
+    ) -> int:
+        """
+        Copies the batch into the sound folder and writes it to the database in one transaction.
+        """
+        sources = [x[0] for x in batch]
+        files = [self.__create_file(folder, file, probe, names) for file, probe in batch]
+        stored = asyncio.run(self.__store(files, sources))
+        try:
+            FileCon.copy_files(conn, stored)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(stored)
+
+    async def __store(self, files: list[dataclasses.File], sources: list[pathlib.Path]) -> list[dataclasses.File]:
+        """
+        Copies the batch into the sound folder, measured and transcoded with ffmpeg first if normalize is set.
+        Returns the files which could be stored.
+        """
+        limit = asyncio.Semaphore(self.workers)
+
+        async def store_one(file: dataclasses.File, source: pathlib.Path) -> bool:
+            async with limit:
+                if self.normalize:
+                    if measurement := await loudness.measure(source):
+                        file.loudness, file.true_peak, file.loudness_range = measurement
+                    await transcode.transcode(
+                        source, transcode.cached_path(self.opus_folder, file.file_hash), loudness.gain(file)
+                    )
+                try:
+                    # a copy, the stored sound must not change with the library
+                    file.file_name = await storage.copy(source, self.sound_folder, file.file_hash)
+                except OSError as e:
+                    self.logger.error(f"Failed to copy {source} to the sound folder: {e}")
+                    return False
+                return True
+
+        results = await asyncio.gather(*(store_one(file, source) for file, source in zip(files, sources)))
+        return [file for file, result in zip(files, results) if result]
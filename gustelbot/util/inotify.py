@@ -0,0 +1,92 @@
+# default
+import ctypes
+import ctypes.util
+import os
+import pathlib
+import struct
+# pip
+# internal
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# everything which changes the set of files or their content
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+# struct inotify_event without the name: wd, mask, cookie, len
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    Minimal non-blocking wrapper of the Linux inotify API, see inotify(7).
+    Raises OSError if inotify is not available.
+    """
+    def __init__(self):
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError("inotify is not available on this system")
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self._watches: dict[int, pathlib.Path] = {}
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def add_watch(self, path: pathlib.Path, mask: int = WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), str(path))
+        self._watches[wd] = path
+
+    def add_watch_recursive(self, path: pathlib.Path):
+        """
+        Watches path and all directories below it.
+        """
+        self.add_watch(path)
+        for root, dirs, _ in os.walk(path):
+            for directory in dirs:
+                self.add_watch(pathlib.Path(root, directory))
+
+    def read(self) -> list[tuple[pathlib.Path | None, int]]:
+        """
+        Returns (path, mask) of all queued events, path is None if events were lost (IN_Q_OVERFLOW).
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                if mask & IN_Q_OVERFLOW:
+                    events.append((None, mask))
+                    continue
+                if (directory := self._watches.get(wd)) is None:
+                    continue
+                events.append((directory.joinpath(os.fsdecode(name)) if name else directory, mask))
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._watches.clear()
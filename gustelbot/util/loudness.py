@@ -0,0 +1,88 @@
+# default
+import asyncio
+import json
+import logging
+import math
+import pathlib
+# pip
+# internal
+from . import dataclasses
+from .engine import Engine
+
+# EBU R128 targets, the same as the defaults of ffmpeg's loudnorm filter
+TARGET_LOUDNESS = -16.0
+MAX_TRUE_PEAK = -1.5
+
+
+async def measure(source: pathlib.Path) -> tuple[float, float, float] | None:
+    """
+    Measures (integrated loudness, true peak, loudness range) of source with ffmpeg's loudnorm filter.
+    Returns None if ffmpeg failed, raises FileNotFoundError if ffmpeg is not installed.
+    """
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-nostats", "-nostdin",
+        "-i", str(source),
+        "-vn", "-filter:a", f"loudnorm=I={TARGET_LOUDNESS}:TP={MAX_TRUE_PEAK}:print_format=json",
+        "-f", "null", "-",
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    output = stderr.decode(errors='replace')
+    if process.returncode != 0:
+        logging.error(f"Failed to measure loudness of {source.name}: {output.strip()}")
+        return None
+    # the json block is printed last
+    try:
+        values = json.loads(output[output.rindex("{"):output.rindex("}") + 1])
+        # silent files are measured as -inf
+        return float(values["input_i"]), float(values["input_tp"]), float(values["input_lra"])
+    except (ValueError, KeyError):
+        logging.error(f"Unexpected loudness measurement output for {source.name}: {output.strip()}")
+        return None
+
+
+def gain(file: dataclasses.File) -> float | None:
+    """
+    Returns the gain in dB that brings file to the target loudness without exceeding the true peak limit,
+    None if the file was not measured yet.
+    """
+    if file.loudness is None:
+        return None
+    if not math.isfinite(file.loudness):
+        return 0.0
+    result = TARGET_LOUDNESS - file.loudness
+    if file.true_peak is not None and math.isfinite(file.true_peak):
+        result = min(result, MAX_TRUE_PEAK - file.true_peak)
+    return round(result, 2)
+
+
+def audio_filter(file_gain: float | None) -> str:
+    """
+    Returns the ffmpeg audio filter applying file_gain, falls back to dynamic normalization if it is unknown.
+    """
+    if file_gain is None:
+        return "loudnorm"
+    return f"volume={file_gain}dB"
+
+
+async def backfill(
+        engine: Engine, files: list[dataclasses.File], folder: pathlib.Path, concurrency: int = 2
+) -> list[int]:
+    """
+    Measures all files without stored measurements and saves the results, returns the ids of the measured files.
+    """
+    limit = asyncio.Semaphore(concurrency)
+
+    async def measure_one(file: dataclasses.File):
+        async with limit:
+            return file.id, await measure(folder.joinpath(file.file_name))
+
+    todo = [x for x in files if x.loudness is None and folder.joinpath(x.file_name).is_file()]
+    results = await asyncio.gather(*(measure_one(x) for x in todo))
+    measurements = [(file_id, *values) for file_id, values in results if values is not None]
+    if measurements:
+        async with engine.connection() as db:
+            await db.file.set_loudness(measurements)
+    return [x[0] for x in measurements]
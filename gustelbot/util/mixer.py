@@ -0,0 +1,103 @@
+# default
+import threading
+# pip
+import discord
+import numpy as np
+# internal
+
+# 20ms of 48kHz 16 bit stereo PCM
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+
+
+class OpusDecoder(discord.AudioSource):
+    """
+    Turns an Opus AudioSource into a PCM AudioSource, without starting a subprocess.
+    """
+    def __init__(self, source: discord.AudioSource):
+        self.source = source
+        self._decoder = discord.opus.Decoder()
+
+    def read(self) -> bytes:
+        if not (data := self.source.read()):
+            return b""
+        return self._decoder.decode(data)
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        self.source.cleanup()
+
+
+class PCMMixer(discord.AudioSource):
+    """
+    Plays several sources at the same time by summing their 48kHz stereo PCM frames with NumPy.
+    Opus sources are decoded, the mix is encoded once by the voice client.
+    add() is called from the event loop, read() from the audio player thread.
+    """
+    def __init__(self, sources: list[discord.AudioSource] = (), max_layers: int = 8):
+        self.max_layers = max_layers
+        self._lock = threading.Lock()
+        self._sources: list[discord.AudioSource] = [PCMMixer.__pcm(x) for x in sources]
+        self._closed = False
+
+    @property
+    def finished(self) -> bool:
+        return self._closed
+
+    def __len__(self):
+        return len(self._sources)
+
+    def add(self, source: discord.AudioSource) -> bool:
+        """
+        Starts playing source on top of the others, returns False if there are too many layers already.
+        """
+        with self._lock:
+            if self._closed or len(self._sources) >= self.max_layers:
+                return False
+            self._sources.append(PCMMixer.__pcm(source))
+        return True
+
+    def read(self) -> bytes:
+        with self._lock:
+            sources = list(self._sources)
+            if not sources:
+                self._closed = True
+                return b""
+        mix = np.zeros(FRAME_SIZE // 2, dtype=np.int32)
+        finished = []
+        for source in sources:
+            data = source.read()
+            if not data:
+                finished.append(source)
+                continue
+            # the last frame of a stream can be shorter
+            if len(data) < FRAME_SIZE:
+                data = data.ljust(FRAME_SIZE, b"\0")
+            mix += np.frombuffer(data, dtype=np.int16, count=FRAME_SIZE // 2)
+        if finished:
+            with self._lock:
+                self._sources = [x for x in self._sources if x not in finished]
+                if not self._sources:
+                    self._closed = True
+            for source in finished:
+                source.cleanup()
+        if self._closed:
+            return b""
+        return np.clip(mix, -32768, 32767).astype(np.int16).tobytes()
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        with self._lock:
+            self._closed = True
+            sources, self._sources = self._sources, []
+        for source in sources:
+            source.cleanup()
+
+    # -- "private" functions
+
+    @staticmethod
+    def __pcm(source: discord.AudioSource) -> discord.AudioSource:
+        return OpusDecoder(source) if source.is_opus() else source
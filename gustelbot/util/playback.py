@@ -0,0 +1,106 @@
+# default
+import asyncio
+import collections
+import logging
+import threading
+from typing import Awaitable
+from typing import Callable
+# pip
+import discord
+# internal
+
+# opus frame of silence, sent while the next source is still being opened
+OPUS_SILENCE = b"\xf8\xff\xfe"
+
+
+class QueuedAudio(discord.AudioSource):
+    """
+    Plays Opus sources back to back as one AudioSource, so there is no gap between them.
+    Queued items are opened in order while the current one plays, at most the current and the next
+    source (and their ffmpeg processes) exist at the same time.
+    read() is called from the audio player thread, everything else from the event loop.
+    """
+    def __init__(self, first: discord.AudioSource, depth: int):
+        self.logger = logging.getLogger(__name__)
+        self.depth = depth
+        self._loop = asyncio.get_running_loop()
+        self._lock = threading.Lock()
+        self._current: discord.AudioSource | None = first
+        self._next: discord.AudioSource | None = None
+        # functions opening the sources of items which weren't opened yet
+        self._pending: collections.deque[Callable[[], Awaitable[discord.AudioSource]]] = collections.deque()
+        self._opening = False
+        self._closed = False
+
+    @property
+    def finished(self) -> bool:
+        return self._closed
+
+    def __len__(self):
+        """Returns the amount of items waiting behind the current one"""
+        return len(self._pending) + self._opening + (self._next is not None)
+
+    def add(self, opener: Callable[[], Awaitable[discord.AudioSource]]) -> bool:
+        """
+        Queues the source returned by opener, returns False if the queue is full or already finished.
+        """
+        with self._lock:
+            if self._closed or len(self) >= self.depth:
+                return False
+            self._pending.append(opener)
+        self.__prefetch()
+        return True
+
+    def read(self) -> bytes:
+        while True:
+            if self._current is not None and (data := self._current.read()):
+                return data
+            with self._lock:
+                finished, self._current, self._next = self._current, self._next, None
+                waiting = self._current is None and (self._pending or self._opening)
+                if self._current is None and not waiting:
+                    self._closed = True
+            if finished is not None:
+                finished.cleanup()
+            self._loop.call_soon_threadsafe(self.__prefetch)
+            if self._current is None:
+                return OPUS_SILENCE if waiting else b""
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        with self._lock:
+            self._closed = True
+            sources = [self._current, self._next]
+            self._current = self._next = None
+            self._pending.clear()
+        for source in sources:
+            if source is not None:
+                source.cleanup()
+
+    # -- "private" functions
+
+    def __prefetch(self):
+        with self._lock:
+            if self._closed or self._opening or self._next is not None or not self._pending:
+                return
+            opener = self._pending.popleft()
+            self._opening = True
+        self._loop.create_task(self.__open(opener))
+
+    async def __open(self, opener: Callable[[], Awaitable[discord.AudioSource]]):
+        try:
+            source = await opener()
+        except Exception:
+            self.logger.exception("Failed to open queued sound.")
+            source = None
+        with self._lock:
+            self._opening = False
+            closed = self._closed
+            if not closed:
+                self._next = source
+        if closed and source is not None:
+            source.cleanup()
+        elif source is None:
+            self.__prefetch()
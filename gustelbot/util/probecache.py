@@ -0,0 +1,216 @@
+# default
+import concurrent.futures
+import hashlib
+import multiprocessing
+import os
+import pathlib
+import sqlite3
+import threading
+from typing import Callable
+# pip
+import mutagen
+# internal
+from . import config
+from . import dataclasses
+
+_default = None
+_default_lock = threading.Lock()
+
+
+class ProbeCache:
+    """
+    Persistent cache of file hashes and audio properties in a sqlite database.
+    Entries are keyed by inode, size and mtime, so a changed or replaced file is read again
+    while an unchanged one only costs a stat().
+    The hash and the audio properties are computed separately when first asked for,
+    so looking up the length of a file never hashes it.
+    Thread safe, the blocking calls are meant to be run in worker threads.
+    """
+    # increased when the table changes, older tables are dropped as they are only a cache
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path: pathlib.Path | str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+                self._conn.execute("DROP TABLE IF EXISTS probes")
+                self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS probes("
+                "inode INTEGER NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, "
+                # NULL until the hash was asked for
+                "md5 TEXT, "
+                # whether the audio properties were read, they are NULL for files which aren't audio
+                "probed INTEGER NOT NULL DEFAULT 0, "
+                "seconds REAL, "
+                "codec TEXT, "
+                "sample_rate INTEGER, "
+                "PRIMARY KEY (inode, size, mtime_ns))"
+            )
+
+    def probe(self, file: pathlib.Path) -> dataclasses.Probe:
+        """
+        Returns hash and audio properties of file, reads the file only for what isn't cached yet.
+        """
+        md5, audio = self.__get(file, md5=True, audio=True)
+        return dataclasses.Probe(md5, *audio)
+
+    def probe_many(
+            self, files: list[pathlib.Path], workers: int | None = None,
+            progress: Callable[[int, int], None] | None = None, audio: bool = True
+    ) -> dict[pathlib.Path, dataclasses.Probe]:
+        """
+        Returns the probes of many files, files without cached entry are read in parallel by worker processes.
+        Without audio only the hashes are computed, the audio properties of the probes are then unknown.
+        progress(done, total) is called after each batch of read files.
+        Missing files are left out of the result.
+        """
+        result = {}
+        todo = []
+        for file in files:
+            try:
+                key = ProbeCache.__key(file)
+            except FileNotFoundError:
+                continue
+            md5, info = self.__lookup(key) or (None, None)
+            if md5 is not None and (info is not None or not audio):
+                result[file] = dataclasses.Probe(md5, *(info or ()))
+            else:
+                todo.append((file, key, md5, info))
+        if not todo:
+            return result
+
+        workers = workers or os.cpu_count() or 1
+        # only a few files per worker are in flight, so memory stays bounded however many files there are
+        batch_size = workers * 4
+        # forking the running bot with its threads and event loop is unsafe, workers start fresh
+        with concurrent.futures.ProcessPoolExecutor(workers, multiprocessing.get_context("spawn")) as pool:
+            for start in range(0, len(todo), batch_size):
+                futures = {
+                    pool.submit(ProbeCache.read, file, md5 is None, audio and info is None): (file, key, md5, info)
+                    for file, key, md5, info in todo[start:start + batch_size]
+                }
+                entries = []
+                for future in concurrent.futures.as_completed(futures):
+                    file, key, md5, info = futures[future]
+                    try:
+                        new_md5, new_info = future.result()
+                    except OSError:
+                        continue
+                    entries.append((key, new_md5, new_info))
+                    result[file] = dataclasses.Probe(md5 or new_md5, *(info or new_info or ()))
+                self.__store(entries)
+                if progress is not None:
+                    progress(min(start + batch_size, len(todo)), len(todo))
+        return result
+
+    def md5(self, file: pathlib.Path) -> str:
+        return self.__get(file, md5=True)[0]
+
+    def seconds(self, file: pathlib.Path) -> float | None:
+        """
+        Returns the length of file, None if it isn't a readable audio file. Doesn't hash the file.
+        """
+        return self.__get(file, audio=True)[1][0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def read(
+            file: pathlib.Path, md5: bool = True, audio: bool = True
+    ) -> tuple[str | None, tuple[float | None, str | None, int | None] | None]:
+        """
+        Hashes and/or parses file without using the cache, returns (md5, (seconds, codec, sample_rate)).
+        What wasn't asked for is None.
+        """
+        return ProbeCache.read_md5(file) if md5 else None, ProbeCache.read_audio(file) if audio else None
+
+    @staticmethod
+    def read_md5(file: pathlib.Path) -> str:
+        with open(file, 'rb') as f:
+            return hashlib.file_digest(f, "md5").hexdigest()
+
+    @staticmethod
+    def read_audio(file: pathlib.Path) -> tuple[float | None, str | None, int | None]:
+        """
+        Returns (seconds, codec, sample_rate) of file, all None if it isn't a readable audio file.
+        """
+        try:
+            audio = mutagen.File(file)
+        except mutagen.MutagenError:
+            audio = None
+        if audio is None or audio.info is None:
+            if not os.path.isfile(file):
+                raise FileNotFoundError(file)
+            return None, None, None
+        return (
+            getattr(audio.info, "length", None),
+            audio.mime[0] if audio.mime else None,
+            getattr(audio.info, "sample_rate", None)
+        )
+
+    # -- "private" functions
+
+    def __get(self, file: pathlib.Path, md5: bool = False, audio: bool = False) -> tuple[str | None, tuple | None]:
+        """
+        Returns (md5, audio properties) of file, reads the file only for what was asked for and isn't cached.
+        """
+        key = ProbeCache.__key(file)
+        cached_md5, cached_info = self.__lookup(key) or (None, None)
+        need_md5 = md5 and cached_md5 is None
+        need_audio = audio and cached_info is None
+        if not need_md5 and not need_audio:
+            return cached_md5, cached_info
+        new_md5, new_info = ProbeCache.read(file, need_md5, need_audio)
+        self.__store([(key, new_md5, new_info)])
+        return cached_md5 or new_md5, cached_info or new_info
+
+    @staticmethod
+    def __key(file: pathlib.Path) -> tuple[int, int, int]:
+        stat = os.stat(file)
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def __lookup(self, key: tuple[int, int, int]) -> tuple[str | None, tuple | None] | None:
+        """
+        Returns (md5, (seconds, codec, sample_rate)) of a cached entry, each None if it wasn't read yet.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT md5,probed,seconds,codec,sample_rate FROM probes WHERE inode=? AND size=? AND mtime_ns=?", key
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[2:] if row[1] else None
+
+    def __store(self, entries: list[tuple[tuple[int, int, int], str | None, tuple | None]]):
+        """
+        Stores (key, md5, audio properties) entries, parts which are None keep their cached value.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO probes (inode,size,mtime_ns,md5,probed,seconds,codec,sample_rate) "
+                "VALUES (?,?,?,?,?,?,?,?) "
+                "ON CONFLICT (inode,size,mtime_ns) DO UPDATE SET "
+                "md5 = COALESCE(excluded.md5, md5), "
+                "seconds = CASE WHEN excluded.probed THEN excluded.seconds ELSE seconds END, "
+                "codec = CASE WHEN excluded.probed THEN excluded.codec ELSE codec END, "
+                "sample_rate = CASE WHEN excluded.probed THEN excluded.sample_rate ELSE sample_rate END, "
+                "probed = max(probed, excluded.probed)",
+                [(*key, md5, info is not None, *(info or (None, None, None))) for key, md5, info in entries]
+            )
+
+
+def default() -> ProbeCache:
+    """
+    Returns the probe cache stored in the data folder.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ProbeCache(config.Config().folders["data"].joinpath("probes.sqlite3"))
+        return _default
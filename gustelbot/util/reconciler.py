@@ -0,0 +1,264 @@
+# default
+import asyncio
+import logging
+import os
+import pathlib
+import time
+# pip
+from discord.ext import tasks
+# internal
+from . import dataclasses
+from . import probecache
+from .engine import Engine
+from .inotify import IN_ISDIR
+from .inotify import IN_CREATE
+from .inotify import IN_MOVED_TO
+from .inotify import Inotify
+
+
+class Reconciler:
+    """
+    Keeps the deleted flag of files in sync with the sound folder.
+    A manifest of (size, mtime, inode, hash) per file avoids hashing files which did not change,
+    hashes are taken from the persistent probe cache.
+    Changes are picked up through inotify, a full scan runs periodically as fallback,
+    every two minutes if inotify is not available.
+    """
+    # seconds between full scans while inotify works
+    FULL_SCAN_INTERVAL = 3600
+    # seconds to collect events before reconciling them
+    DEBOUNCE = 1.0
+    # files to hash at once from which worker processes are used, e.g. after restoring a backup
+    BULK_THRESHOLD = 32
+
+    def __init__(self, engine: Engine, folder: pathlib.Path):
+        self.logger = logging.getLogger(__name__)
+        self.engine = engine
+        self.folder = folder
+        # relative path -> (size, mtime_ns, inode, md5 or None if not calculated yet)
+        self._manifest: dict[str, tuple[int, int, int, str | None]] = {}
+        self._inotify: Inotify | None = None
+        self._watch_failed = False
+        # monotonic time of the last full scan, None if one is due
+        self._last_scan: float | None = None
+        self._dirty: set[str] = set()
+        self._task: asyncio.Task | None = None
+
+    @tasks.loop(seconds=120)
+    async def maintain(self):
+        """
+        Starts watching the folder if possible and runs a full scan if one is due.
+        """
+        if self._inotify is None:
+            self.__watch()
+        if (
+            self._inotify is not None and self._last_scan is not None
+            and time.monotonic() - self._last_scan < self.FULL_SCAN_INTERVAL
+        ):
+            return
+        try:
+            await self.scan()
+        except Exception:
+            self.logger.exception("Failed to reconcile sound folder.")
+
+    @maintain.after_loop
+    async def stop_watching(self):
+        if self._inotify is not None:
+            self.__close_watch()
+
+    async def scan(self):
+        """
+        Compares the whole folder with all files in the database.
+        """
+        self._last_scan = time.monotonic()
+        present = await asyncio.to_thread(self.__walk)
+        async with self.engine.connection() as db:
+            rows = await db.file.get_file()
+        self.__update_manifest(present, full=True)
+        await self.__apply(rows, present)
+
+    async def reconcile(self, names: set[str]):
+        """
+        Compares only the given paths relative to the folder with the database.
+        """
+        present = await asyncio.to_thread(self.__stat, names)
+        async with self.engine.connection() as db:
+            rows = await db.file.get_files_by_name(list(names))
+        self.__update_manifest(present, names=names)
+        await self.__apply(rows, present)
+
+    # -- "private" functions
+
+    def __walk(self) -> dict[str, tuple[int, int, int]]:
+        """Returns (size, mtime_ns, inode) of every file below the folder"""
+        result = {}
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = pathlib.Path(root, name)
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                result[path.relative_to(self.folder).as_posix()] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        return result
+
+    def __stat(self, names: set[str]) -> dict[str, tuple[int, int, int]]:
+        result = {}
+        for name in names:
+            try:
+                stat = self.folder.joinpath(name).stat()
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            if not self.folder.joinpath(name).is_file():
+                continue
+            result[name] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        return result
+
+    def __update_manifest(
+            self, present: dict[str, tuple[int, int, int]], full: bool = False, names: set[str] = frozenset()
+    ):
+        """
+        Updates the manifest with the stats of present files, the hash of changed files is dropped.
+        Files which are not present anymore are removed from the manifest, either all or only those in names.
+        """
+        for name, stat in present.items():
+            entry = self._manifest.get(name)
+            if entry is None or entry[:3] != stat:
+                self._manifest[name] = (*stat, None)
+        gone = (self._manifest.keys() - present.keys()) if full else (names - present.keys())
+        for name in gone:
+            self._manifest.pop(name, None)
+
+    async def __hash(self, name: str) -> str | None:
+        """Returns the md5 of a file from the manifest, calculates it if needed"""
+        if (entry := self._manifest.get(name)) is None:
+            return None
+        if entry[3] is None:
+            try:
+                md5 = await asyncio.to_thread(probecache.default().md5, self.folder.joinpath(name))
+            except FileNotFoundError:
+                return None
+            # the file might have changed while hashing
+            if self._manifest.get(name, (None,))[:3] == entry[:3]:
+                self._manifest[name] = (*entry[:3], md5)
+            return md5
+        return entry[3]
+
+    async def __hash_bulk(self, names: list[str]):
+        """
+        Hashes many files in parallel worker processes and stores the hashes in the manifest.
+        """
+        self.logger.info(f"Hashing {len(names)} files.")
+
+        def progress(done: int, total: int):
+            self.logger.info(f"Hashed {done}/{total} files.")
+
+        entries = {x: self._manifest[x] for x in names}
+        paths = {self.folder.joinpath(x): x for x in names}
+        probes = await asyncio.to_thread(
+            probecache.default().probe_many, list(paths), progress=progress, audio=False
+        )
+        for path, probe in probes.items():
+            name = paths[path]
+            # the file might have changed while hashing
+            if self._manifest.get(name) == entries[name]:
+                self._manifest[name] = (*entries[name][:3], probe.md5)
+
+    async def __apply(self, rows: list[dataclasses.File], present: dict[str, tuple[int, int, int]]):
+        """
+        Marks rows whose file is missing as deleted, and deleted rows whose file is present with the right hash
+        as restored. All updates are written in one transaction.
+        """
+        missing = [x for x in rows if not x.deleted and x.file_name not in present]
+        unhashed = [
+            x.file_name for x in rows
+            if x.deleted and x.file_name in self._manifest and self._manifest[x.file_name][3] is None
+        ]
+        if len(unhashed) >= self.BULK_THRESHOLD:
+            await self.__hash_bulk(unhashed)
+        restored = []
+        for row in rows:
+            if row.deleted and row.file_name in present and await self.__hash(row.file_name) == row.file_hash:
+                restored.append(row)
+        if not missing and not restored:
+            return
+        async with self.engine.connection() as db:
+            if missing:
+                await db.file.set_deleted([x.id for x in missing], True)
+            if restored:
+                await db.file.set_deleted([x.id for x in restored], False)
+        if missing:
+            self.logger.info(f"Marked the files {[x.file_name for x in missing]} as deleted.")
+        if restored:
+            self.logger.info(f"Marked the files {[x.file_name for x in restored]} as restored.")
+
+    def __watch(self):
+        try:
+            self._inotify = Inotify()
+            self._inotify.add_watch_recursive(self.folder)
+        except OSError as e:
+            if not self._watch_failed:
+                self.logger.warning(f"Can't watch the sound folder ({e}), scanning it periodically instead.")
+            self._watch_failed = True
+            if self._inotify is not None:
+                self._inotify.close()
+            self._inotify = None
+            return
+        asyncio.get_running_loop().add_reader(self._inotify.fileno(), self.__on_events)
+        self.logger.debug(f"Watching {self.folder} for changes.")
+
+    def __close_watch(self):
+        try:
+            asyncio.get_running_loop().remove_reader(self._inotify.fileno())
+        except ValueError:
+            pass
+        self._inotify.close()
+        self._inotify = None
+
+    def __on_events(self):
+        """
+        Called by the event loop when inotify events are available.
+        """
+        try:
+            events = self._inotify.read()
+        except OSError:
+            self.logger.exception("Failed to read file system events, falling back to scanning.")
+            self.__close_watch()
+            return
+        for path, mask in events:
+            if path is None:
+                # events were lost, the next maintenance run scans everything
+                self._last_scan = None
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.__on_new_directory(path)
+                continue
+            if path == self.folder:
+                continue
+            self._dirty.add(path.relative_to(self.folder).as_posix())
+        if self._dirty and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self.__reconcile_dirty())
+
+    def __on_new_directory(self, path: pathlib.Path):
+        try:
+            self._inotify.add_watch_recursive(path)
+        except OSError:
+            self.logger.warning(f"Can't watch {path}, it is covered by the periodic scan.")
+            self._last_scan = None
+            return
+        # files might have been created before the watch was added
+        for root, _, files in os.walk(path):
+            for name in files:
+                self._dirty.add(pathlib.Path(root, name).relative_to(self.folder).as_posix())
+
+    async def __reconcile_dirty(self):
+        await asyncio.sleep(self.DEBOUNCE)
+        while self._dirty:
+            names, self._dirty = self._dirty, set()
+            try:
+                await self.reconcile(names)
+            except Exception:
+                self.logger.exception("Failed to reconcile changed sound files.")
+                self._last_scan = None
+                return
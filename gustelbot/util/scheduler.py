@@ -0,0 +1,93 @@
+# default
+import asyncio
+import heapq
+import logging
+from typing import Awaitable
+from typing import Callable
+# pip
+# internal
+
+
+class DeadlineScheduler:
+    """
+    Calls callback(key) once the deadline of a key has passed.
+    All deadlines are kept in one heap and served by a single task, which only wakes up
+    when the earliest deadline is due or an earlier one was added.
+    """
+    def __init__(self, callback: Callable[[object], Awaitable[None]]):
+        self.logger = logging.getLogger(__name__)
+        self.callback = callback
+        # current deadline per key, heap entries not matching it are outdated and skipped
+        self._deadlines: dict[object, float] = {}
+        self._heap: list[tuple[float, int, object]] = []
+        # tie breaker, keys don't have to be comparable
+        self._counter = 0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._callbacks: set[asyncio.Task] = set()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def schedule(self, key, delay: float):
+        """
+        Sets the deadline of key to delay seconds from now, replacing a previous one.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + delay
+        self._deadlines[key] = deadline
+        # the task sleeps until the earliest deadline, it has to recalculate if this one is earlier
+        if not self._heap or deadline < self._heap[0][0]:
+            self._wakeup.set()
+        self._counter += 1
+        heapq.heappush(self._heap, (deadline, self._counter, key))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.__run())
+
+    def cancel(self, key):
+        """
+        Removes the deadline of key, does nothing if it has none.
+        """
+        self._deadlines.pop(key, None)
+
+    def close(self):
+        self._deadlines.clear()
+        self._heap.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in self._callbacks:
+            task.cancel()
+
+    # -- "private" functions
+
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+        while self._deadlines:
+            deadline, _, key = self._heap[0]
+            if self._deadlines.get(key) != deadline:
+                heapq.heappop(self._heap)
+                continue
+            if (delay := deadline - loop.time()) > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            del self._deadlines[key]
+            # callbacks may take a while, they must not delay other deadlines
+            task = asyncio.create_task(self.__call(key))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+        self._heap.clear()
+
+    async def __call(self, key):
+        try:
+            await self.callback(key)
+        except Exception:
+            self.logger.exception(f"Scheduled callback for {key} failed.")
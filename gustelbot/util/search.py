@@ -0,0 +1,275 @@
+# default
+import bisect
+import collections
+import heapq
+import math
+import typing
+from difflib import SequenceMatcher
+# pip
+# internal
+
+
+class SimilarityIndex:
+    """
+    Inverted index of characters, used to find names similar to a search string.
+    Each name is indexed under (character, occurrence) pairs, so the postings give difflib's quick_ratio of every
+    name at once. It is an upper bound of the SequenceMatcher ratio, names are compared best bound first
+    until no remaining one can reach the threshold, instead of comparing every indexed name.
+    Postings are split by name length, per length only the rarest characters of the search string are looked up
+    in full (prefix filtering): a name sharing none of them can't share enough characters to reach the threshold.
+    """
+    def __init__(self):
+        # token -> name length -> keys
+        self._postings: dict[tuple[str, int], dict[int, set]] = collections.defaultdict(dict)
+        # token -> amount of names containing it
+        self._frequency: collections.Counter[tuple[str, int]] = collections.Counter()
+        # name length -> amount of names
+        self._lengths: collections.Counter[int] = collections.Counter()
+        self._names: dict[object, str] = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, key, name: str):
+        """
+        Indexes name under key, replaces a previous name of key.
+        """
+        self.remove(key)
+        name = name.lower()
+        self._names[key] = name
+        self._lengths[len(name)] += 1
+        for token in SimilarityIndex.tokens(name):
+            self._postings[token].setdefault(len(name), set()).add(key)
+            self._frequency[token] += 1
+
+    def remove(self, key):
+        if (name := self._names.pop(key, None)) is None:
+            return
+        self._lengths[len(name)] -= 1
+        if not self._lengths[len(name)]:
+            del self._lengths[len(name)]
+        for token in SimilarityIndex.tokens(name):
+            by_length = self._postings[token]
+            by_length[len(name)].discard(key)
+            if not by_length[len(name)]:
+                del by_length[len(name)]
+            self._frequency[token] -= 1
+            if not self._frequency[token]:
+                del self._frequency[token]
+                del self._postings[token]
+
+    def clear(self):
+        self._postings.clear()
+        self._frequency.clear()
+        self._lengths.clear()
+        self._names.clear()
+
+    def candidates(self, text: str, threshold: float = 0.65) -> list[tuple[object, float]]:
+        """
+        Returns (key, bound) of the names whose ratio with text can reach threshold, highest bound first.
+        """
+        text = text.lower()
+        if threshold > 1:
+            return []
+        # rarest first, they find the fewest names
+        tokens = sorted(SimilarityIndex.tokens(text), key=lambda x: self._frequency.get(x, 0))
+        postings = [self._postings.get(x, {}) for x in tokens]
+        # the bound 2 * shared / (len(text) + length) can only reach threshold if the shorter one is long enough,
+        # float errors must only widen the limits
+        min_length = math.ceil(len(text) * threshold / (2 - threshold) - 1e-9)
+        max_length = math.floor(len(text) * (2 - threshold) / threshold + 1e-9) if threshold > 0 else math.inf
+        result = []
+        for length in self._lengths:
+            if not min_length <= length <= max_length:
+                continue
+            # characters both strings have in common, as in SequenceMatcher.quick_ratio()
+            min_shared = math.ceil(threshold * (len(text) + length) / 2 - 1e-9)
+            # a name missing all of the rarest len(tokens) - min_shared + 1 characters shares too few of the others
+            prefix = len(tokens) - min_shared + 1
+            shared = collections.Counter()
+            for by_length in postings[:prefix]:
+                shared.update(by_length.get(length, ()))
+            # the common characters only count for the names found so far
+            for remaining, by_length in zip(range(min_shared - 2, -1, -1), postings[prefix:]):
+                if keys := by_length.get(length):
+                    shared.update(shared.keys() & keys)
+                # names which can't reach min_shared with the remaining characters are dropped
+                shared = collections.Counter({x: n for x, n in shared.items() if n + remaining >= min_shared})
+                if not shared:
+                    break
+            for key, count in shared.items():
+                if count >= min_shared and (bound := 2 * count / (len(text) + length)) >= threshold:
+                    result.append((key, bound))
+        result.sort(key=lambda x: x[1], reverse=True)
+        return result
+
+    def search(
+            self, text: str, threshold: float = 0.65, limit: int = 32, accept: typing.Callable[[object], bool] = None
+    ) -> list[tuple[object, float]]:
+        """
+        Returns (key, ratio) of up to limit names whose SequenceMatcher ratio reaches threshold, best first.
+        The result is the same as comparing text with every indexed name.
+        accept filters the keys before they are compared, so the limit applies to the accepted names only.
+        """
+        text = text.lower()
+        matcher = SequenceMatcher()
+        # SequenceMatcher caches information about the second sequence
+        matcher.set_seq2(text)
+        # min heap of the best (ratio, order, key) found so far
+        best = []
+        for order, (key, bound) in enumerate(self.candidates(text, threshold)):
+            if len(best) >= limit and bound < best[0][0]:
+                # sorted by bound, no remaining name can beat the worst kept one
+                break
+            if accept is not None and not accept(key):
+                continue
+            matcher.set_seq1(self._names[key])
+            if (ratio := matcher.ratio()) < threshold:
+                continue
+            if len(best) < limit:
+                heapq.heappush(best, (ratio, -order, key))
+            elif ratio > best[0][0]:
+                heapq.heapreplace(best, (ratio, -order, key))
+        return [(key, ratio) for ratio, _, key in sorted(best, reverse=True)]
+
+    @staticmethod
+    def tokens(text: str) -> list[tuple[str, int]]:
+        """
+        Returns (character, occurrence) of every character of text, "aba" becomes a1, b1, a2.
+        """
+        seen = collections.Counter()
+        result = []
+        for char in text:
+            seen[char] += 1
+            result.append((char, seen[char]))
+        return result
+
+
+class PrefixIndex:
+    """
+    Sorted list of names and their word suffixes, answers prefix lookups with a binary search.
+    "big boom" can be found by typing "bi" as well as "bo".
+    """
+    def __init__(self):
+        self._terms: list[tuple[str, object]] = []
+        self._keys: dict[object, tuple[str, list[str]]] = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key, name: str):
+        """
+        Indexes name under key, replaces a previous name of key.
+        """
+        self.remove(key)
+        terms = PrefixIndex.terms(name)
+        self._keys[key] = (name, terms)
+        for term in terms:
+            bisect.insort(self._terms, (term, key))
+
+    def remove(self, key):
+        if (entry := self._keys.pop(key, None)) is None:
+            return
+        for term in entry[1]:
+            i = bisect.bisect_left(self._terms, (term, key))
+            if i < len(self._terms) and self._terms[i] == (term, key):
+                del self._terms[i]
+
+    def clear(self):
+        self._terms.clear()
+        self._keys.clear()
+
+    def build(self, items: list[tuple[object, str]]):
+        """
+        Replaces the index content with (key, name) items, faster than adding them one by one.
+        """
+        self.clear()
+        for key, name in items:
+            terms = PrefixIndex.terms(name)
+            self._keys[key] = (name, terms)
+            self._terms.extend((term, key) for term in terms)
+        self._terms.sort()
+
+    def lookup(self, prefix: str, limit: int = 25) -> list[tuple[object, str]]:
+        """
+        Returns up to limit (key, name) whose name or one of its words starts with prefix.
+        Matches on the whole name come first, the rest is sorted alphabetically.
+        """
+        prefix = prefix.lower().strip()
+        # all terms starting with prefix form one contiguous range
+        start = bisect.bisect_left(self._terms, (prefix,))
+        end = bisect.bisect_left(self._terms, (prefix + chr(0x10ffff),), lo=start)
+        # bound the work for very short prefixes matching most of the index
+        end = min(end, start + limit * 20)
+
+        result = {}
+        for whole_name in (True, False):
+            for i in range(start, end):
+                term, key = self._terms[i]
+                name = self._keys[key][0]
+                if key not in result and (not whole_name or name.lower() == term):
+                    result[key] = name
+                    if len(result) >= limit:
+                        return list(result.items())
+        return list(result.items())
+
+    @staticmethod
+    def terms(name: str) -> list[str]:
+        """
+        Returns the lowercase name and its suffixes starting at each further word.
+        """
+        name = name.lower()
+        terms = [name]
+        for i, char in enumerate(name):
+            if i > 0 and not name[i - 1].isalnum() and char.isalnum():
+                terms.append(name[i:])
+        return terms
+
+
+class TagIndex:
+    """
+    Inverted index from lowercase tag names to the set of keys carrying them.
+    Tag queries are answered with set intersections and unions.
+    """
+    def __init__(self):
+        self._postings: dict[str, set] = collections.defaultdict(set)
+        self._tags: dict[object, tuple[str, ...]] = {}
+
+    def add(self, key, tags: tuple[str, ...]):
+        """
+        Indexes tags under key, replaces previous tags of key.
+        """
+        self.remove(key)
+        tags = tuple({x.lower() for x in tags})
+        if not tags:
+            return
+        self._tags[key] = tags
+        for tag in tags:
+            self._postings[tag].add(key)
+
+    def remove(self, key):
+        for tag in self._tags.pop(key, ()):
+            postings = self._postings[tag]
+            postings.discard(key)
+            if not postings:
+                del self._postings[tag]
+
+    def clear(self):
+        self._postings.clear()
+        self._tags.clear()
+
+    def all_of(self, tags: list[str]) -> set:
+        """
+        Returns keys carrying every one of the tags.
+        """
+        postings = sorted((self._postings.get(x.lower(), set()) for x in tags), key=len)
+        if not postings:
+            return set()
+        # intersect starting with the smallest set
+        return postings[0].intersection(*postings[1:])
+
+    def any_of(self, tags: list[str]) -> set:
+        """
+        Returns keys carrying at least one of the tags.
+        """
+        return set().union(*(self._postings.get(x.lower(), ()) for x in tags))
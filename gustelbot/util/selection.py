@@ -0,0 +1,83 @@
+# default
+import bisect
+import random
+# pip
+# internal
+
+
+class DurationIndex:
+    """
+    Keys sorted by duration, the keys not longer than a limit are a prefix of the list.
+    generation only changes when the order changes, positions are stable until then.
+    """
+    def __init__(self):
+        self._entries: list[tuple[int, int]] = []
+        self._seconds: dict[int, int] = {}
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, key: int, seconds: int | None):
+        seconds = seconds or 0
+        if self._seconds.get(key) == seconds:
+            return
+        self.remove(key)
+        self._seconds[key] = seconds
+        bisect.insort(self._entries, (seconds, key))
+        self.generation += 1
+
+    def remove(self, key: int):
+        if (seconds := self._seconds.pop(key, None)) is None:
+            return
+        i = bisect.bisect_left(self._entries, (seconds, key))
+        del self._entries[i]
+        self.generation += 1
+
+    def build(self, items: list[tuple[int, int | None]]):
+        """
+        Replaces the index content with (key, seconds) items.
+        """
+        self._seconds = {key: seconds or 0 for key, seconds in items}
+        entries = sorted((seconds, key) for key, seconds in self._seconds.items())
+        if entries != self._entries:
+            self._entries = entries
+            self.generation += 1
+
+    def count(self, max_len: int | None = None) -> int:
+        """
+        Returns the amount of keys not longer than max_len seconds, 0 or None means unlimited.
+        """
+        if not max_len:
+            return len(self._entries)
+        return bisect.bisect_right(self._entries, (max_len, float('inf')))
+
+    def at(self, position: int) -> int:
+        """
+        Returns the key at position, the shortest key is at position 0.
+        """
+        return self._entries[position][1]
+
+
+class ShuffleBag:
+    """
+    Draws every position of range(size) once in random order before starting over.
+    The shuffle is done lazily (sparse Fisher-Yates), so each draw is O(1) no matter how big size is.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._swaps: dict[int, int] = {}
+        self._drawn = 0
+
+    def draw(self) -> int:
+        if self.size <= 0:
+            raise IndexError("Cannot draw from an empty bag")
+        if self._drawn >= self.size:
+            self._swaps.clear()
+            self._drawn = 0
+        j = random.randrange(self._drawn, self.size)
+        value = self._swaps.get(j, j)
+        # move the not yet drawn value at the front into the gap
+        self._swaps[j] = self._swaps.pop(self._drawn, self._drawn)
+        self._drawn += 1
+        return value
@@ -0,0 +1,134 @@
+# default
+import collections
+from dataclasses import dataclass
+# pip
+import discord
+# internal
+from .catalog import SoundCatalog
+from .engine import Engine
+
+
+@dataclass(frozen=True)
+class Page:
+    """
+    One page of the sound list.
+    names: (display_name, file_id) ordered by name
+    has_previous/has_next: whether there are sounds before/after this page
+    text: rendered embed description
+    """
+    names: tuple[tuple[str, int], ...]
+    has_previous: bool
+    has_next: bool
+    text: str
+
+
+class SoundPages:
+    """
+    Reads the sound list page by page, rendered pages are cached until the catalog changes.
+    Pages are addressed by the key of the neighbouring page, so each one is a single small indexed query.
+    """
+    PAGE_SIZE = 20
+    CACHE_SIZE = 256
+    # longer names are cut off, so a page always fits into an embed description
+    MAX_NAME_LENGTH = 100
+
+    def __init__(self, engine: Engine, catalog: SoundCatalog):
+        self.engine = engine
+        self.catalog = catalog
+        self._cache: collections.OrderedDict[tuple, Page] = collections.OrderedDict()
+        self._version = catalog.version
+
+    async def page(
+            self,
+            after: tuple[str, int] | None = None,
+            before: tuple[str, int] | None = None,
+            tag: str | None = None,
+            uploader_id: int | None = None
+    ) -> Page:
+        """
+        Returns the page following after, or preceding before, the first page if neither is given.
+        """
+        if self._version != self.catalog.version:
+            self._cache.clear()
+            self._version = self.catalog.version
+        # tags match case-insensitively, so their pages are the same
+        key = (after, before, tag.lower() if tag else tag, uploader_id)
+        if (page := self._cache.get(key)) is not None:
+            self._cache.move_to_end(key)
+            return page
+        version = self._version
+        async with self.engine.connection() as db:
+            # one more row than needed tells if there is another page
+            names = await db.file.get_name_page(self.PAGE_SIZE + 1, after, before, tag, uploader_id)
+        if before is not None and after is None:
+            more_before, more_after = len(names) > self.PAGE_SIZE, True
+            names = names[-self.PAGE_SIZE:]
+        else:
+            more_before, more_after = after is not None, len(names) > self.PAGE_SIZE
+            names = names[:self.PAGE_SIZE]
+        page = Page(tuple(names), more_before, more_after, self.__render(names))
+        # the catalog might have changed during the query
+        if version == self.catalog.version:
+            self._cache[key] = page
+            if len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return page
+
+    # -- "private" functions
+
+    def __render(self, names: list[tuple[str, int]]) -> str:
+        if not names:
+            return "No sounds found."
+        lines = []
+        for name, _ in names:
+            if len(name) > self.MAX_NAME_LENGTH:
+                name = name[:self.MAX_NAME_LENGTH - 1] + "…"
+            lines.append(discord.utils.escape_markdown(name))
+        return "\n".join(lines)
+
+
+class SoundListView(discord.ui.View):
+    """
+    Previous/next buttons below a sound list message.
+    """
+    def __init__(self, pages: SoundPages, tag: str | None = None, uploader: discord.abc.User | None = None):
+        super().__init__(timeout=300, disable_on_timeout=True)
+        self.pages = pages
+        self.tag = tag
+        self.uploader = uploader
+        self.number = 1
+        self.current: Page | None = None
+
+    async def first_page(self) -> discord.Embed:
+        return await self.__show()
+
+    @discord.ui.button(label="Previous", emoji="◀️")
+    async def previous_page(self, _: discord.ui.Button, interaction: discord.Interaction):
+        self.number -= 1
+        embed = await self.__show(before=self.current.names[0] if self.current.names else None)
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(label="Next", emoji="▶️")
+    async def next_page(self, _: discord.ui.Button, interaction: discord.Interaction):
+        self.number += 1
+        embed = await self.__show(after=self.current.names[-1] if self.current.names else None)
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    # -- "private" functions
+
+    async def __show(self, after: tuple[str, int] | None = None, before: tuple[str, int] | None = None):
+        uploader_id = self.uploader.id if self.uploader is not None else None
+        self.current = await self.pages.page(after, before, self.tag, uploader_id)
+        if not self.current.has_previous:
+            # the list might have shrunk in front of this page
+            self.number = 1
+        self.previous_page.disabled = not self.current.has_previous
+        self.next_page.disabled = not self.current.has_next
+        embed = discord.Embed(title="Available sounds", description=self.current.text)
+        footer = [f"Page {self.number}"]
+        if self.tag is not None:
+            footer.append(f"tag: {self.tag}")
+        if self.uploader is not None:
+            footer.append(f"uploader: {self.uploader.display_name}")
+        embed.set_footer(text=" | ".join(footer))
+        return embed
@@ -0,0 +1,148 @@
+# default
+import asyncio
+import fcntl
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+# pip
+# internal
+from . import dataclasses
+from .engine import Engine
+
+# ioctl cloning a file on copy-on-write filesystems like btrfs and xfs, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def blob_name(file_hash: str, suffix: str) -> str:
+    """
+    Returns the content addressed name of a file relative to the sound folder: <hash[0:2]>/<hash[2:4]>/<hash><suffix>
+    """
+    return f"{file_hash[0:2]}/{file_hash[2:4]}/{file_hash}{suffix.lower()}"
+
+
+def is_blob_name(file: dataclasses.File) -> bool:
+    return file.file_name == blob_name(file.file_hash, pathlib.PurePosixPath(file.file_name).suffix)
+
+
+async def store(source: pathlib.Path, folder: pathlib.Path, file_hash: str) -> tuple[str, bool]:
+    """
+    Moves source to its content addressed place in folder, returns its name relative to folder and
+    whether the file was created. If the same content is stored already, source is removed instead,
+    the existing file may be referenced by other sounds then and must not be removed.
+    """
+    name = blob_name(file_hash, source.suffix)
+    created = await asyncio.to_thread(_store, source, folder.joinpath(name))
+    return name, created
+
+
+async def copy(source: pathlib.Path, folder: pathlib.Path, file_hash: str) -> str:
+    """
+    Copies source to its content addressed place in folder without touching it, returns its name relative to folder.
+    The stored file never shares its content with source, so later changes of source can't alter it.
+    """
+    name = blob_name(file_hash, source.suffix)
+    await asyncio.to_thread(_copy, source, folder.joinpath(name))
+    return name
+
+
+def _store(source: pathlib.Path, target: pathlib.Path) -> bool:
+    """
+    Moves source to target, returns False if target existed already.
+    target is created with link(2), which fails if it exists, so of concurrent stores only one creates it.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        source.unlink()
+        return False
+    except OSError:
+        # source is on another filesystem, copy it next to target under a unique name first
+        fd, tmp_name = tempfile.mkstemp(dir=target.parent, suffix=".part")
+        os.close(fd)
+        tmp_target = pathlib.Path(tmp_name)
+        try:
+            shutil.copy2(source, tmp_target)
+            os.link(tmp_target, target)
+        except FileExistsError:
+            source.unlink()
+            return False
+        except OSError:
+            # filesystem without hard links
+            if target.is_file():
+                source.unlink()
+                return False
+            tmp_target.replace(target)
+        finally:
+            tmp_target.unlink(missing_ok=True)
+    source.unlink()
+    return True
+
+
+def _link(source: pathlib.Path, target: pathlib.Path):
+    """
+    Makes source available as target as well, keeps an already existing target.
+    """
+    if target.is_file():
+        return
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        # filesystem without hard links, copy to a temporary name so target is never incomplete
+        tmp_target = target.with_name(f"{target.name}.part")
+        shutil.copy2(source, tmp_target)
+        tmp_target.replace(target)
+
+
+def _copy(source: pathlib.Path, target: pathlib.Path):
+    """
+    Copies source to target, keeps an already existing target. Uses a copy-on-write clone where the filesystem
+    supports it, which costs no space until one of the files changes.
+    """
+    if target.is_file():
+        return
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # copy to a temporary name so target is never incomplete
+    tmp_target = target.with_name(f"{target.name}.part")
+    with open(source, 'rb') as src, open(tmp_target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            shutil.copyfileobj(src, dst)
+    shutil.copystat(source, tmp_target)
+    tmp_target.replace(target)
+
+
+async def migrate(engine: Engine, folder: pathlib.Path, batch_size: int = 100) -> int:
+    """
+    Moves files with old style names to their content addressed place while the bot is running.
+    Each file is linked to its new name first, then the database is updated and the old name is removed,
+    so it can be played during the whole migration. Returns the amount of migrated files.
+    """
+    async with engine.connection() as db:
+        files = [x for x in await db.file.get_file() if not is_blob_name(x)]
+    migrated = 0
+    for start in range(0, len(files), batch_size):
+        renames = []
+        for file in files[start:start + batch_size]:
+            source = folder.joinpath(file.file_name)
+            if not source.is_file():
+                continue
+            name = blob_name(file.file_hash, source.suffix)
+            try:
+                await asyncio.to_thread(_link, source, folder.joinpath(name))
+            except OSError:
+                logging.exception(f"Failed to migrate {file.file_name}.")
+                continue
+            renames.append((file.id, name, source))
+        if not renames:
+            continue
+        async with engine.connection() as db:
+            await db.file.rename_files([(file_id, name) for file_id, name, _ in renames])
+        for _, _, source in renames:
+            await asyncio.to_thread(source.unlink, True)
+        migrated += len(renames)
+    return migrated
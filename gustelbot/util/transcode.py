@@ -0,0 +1,90 @@
+# default
+import asyncio
+import logging
+import os
+import pathlib
+import tempfile
+# pip
+# internal
+from . import dataclasses
+from . import loudness
+
+# targets being written right now, another transcode of the same file is skipped
+_in_progress: set[pathlib.Path] = set()
+
+
+def encoder_arguments(gain: float | None = None) -> list[str]:
+    """
+    Returns the ffmpeg output arguments for normalized 48kHz stereo Opus in 20ms frames, as Discord expects it.
+    """
+    return [
+        "-vn", "-map_metadata", "-1",
+        "-filter:a", loudness.audio_filter(gain),
+        "-ar", "48000", "-ac", "2",
+        "-c:a", "libopus", "-b:a", "128k", "-frame_duration", "20",
+        "-f", "ogg"
+    ]
+
+
+def cached_path(folder: pathlib.Path, file_hash: str) -> pathlib.Path:
+    """
+    Returns where the transcoded version of a file is stored.
+    """
+    return folder.joinpath(f"{file_hash}.ogg")
+
+
+async def transcode(source: pathlib.Path, target: pathlib.Path, gain: float | None = None) -> bool:
+    """
+    Converts source into a loudness normalized 48kHz stereo Ogg/Opus file, which can be streamed without re-encoding.
+    gain is the stored static gain of the file in dB, without it the file is normalized dynamically.
+    Returns False if ffmpeg failed or target is being written already, raises FileNotFoundError if ffmpeg is not
+    installed.
+    """
+    if target in _in_progress:
+        return False
+    _in_progress.add(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file of its own first, so playback never picks up a half written file
+    fd, tmp_name = tempfile.mkstemp(dir=target.parent, prefix=f"{target.stem}.", suffix=f".part{target.suffix}")
+    os.close(fd)
+    tmp_target = pathlib.Path(tmp_name)
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-i", str(source),
+            *encoder_arguments(gain), str(tmp_target),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            logging.error(f"Failed to transcode {source.name}: {stderr.decode(errors='replace').strip()}")
+            return False
+        tmp_target.replace(target)
+        return True
+    finally:
+        tmp_target.unlink(missing_ok=True)
+        _in_progress.discard(target)
+
+
+async def backfill(
+        files: list[dataclasses.File], source_folder: pathlib.Path, target_folder: pathlib.Path, concurrency: int = 2
+) -> int:
+    """
+    Transcodes all files which have no cached version yet, returns the amount of transcoded files.
+    """
+    limit = asyncio.Semaphore(concurrency)
+
+    async def transcode_one(file: dataclasses.File) -> bool:
+        async with limit:
+            return await transcode(
+                source_folder.joinpath(file.file_name), cached_path(target_folder, file.file_hash), loudness.gain(file)
+            )
+
+    todo = [
+        x for x in files
+        if not cached_path(target_folder, x.file_hash).exists() and source_folder.joinpath(x.file_name).is_file()
+    ]
+    results = await asyncio.gather(*(transcode_one(x) for x in todo))
+    return sum(results)
@@ -0,0 +1,51 @@
+# default
+import asyncio
+import hashlib
+import pathlib
+# pip
+import aiohttp
+# internal
+from . import filemgr
+
+CHUNK_SIZE = 65536
+
+
+class UploadError(Exception):
+    """
+    Upload was rejected, the message can be shown to the user.
+    """
+
+
+async def download(url: str, target: pathlib.Path, max_size: int) -> tuple[str, int]:
+    """
+    Streams url into target while hashing it, returns (md5, size).
+    Aborts as soon as more than max_size bytes arrive, target is removed if the download fails.
+    """
+    md5 = hashlib.md5()
+    size = 0
+    async with aiohttp.ClientSession() as session, session.get(url) as response:
+        if response.status != 200:
+            raise UploadError(f"Download failed with status {response.status}")
+        if response.content_length is not None and response.content_length > max_size:
+            raise UploadError(f"Maximum size is {max_size // 1000000}MB")
+        file = await asyncio.to_thread(open, target, 'wb')
+        try:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadError(f"Maximum size is {max_size // 1000000}MB")
+                md5.update(chunk)
+                await asyncio.to_thread(file.write, chunk)
+        except BaseException:
+            await asyncio.to_thread(file.close)
+            target.unlink(missing_ok=True)
+            raise
+        await asyncio.to_thread(file.close)
+    return md5.hexdigest(), size
+
+
+async def probe(file: pathlib.Path) -> float | None:
+    """
+    Returns the length of file in seconds, without blocking the event loop.
+    """
+    return await asyncio.to_thread(filemgr.get_sound_length, file)
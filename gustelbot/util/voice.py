@@ -1,9 +1,35 @@
 # default
+import asyncio
+import collections
+import functools
 import logging
+import pathlib
+import statistics
+import time
 # pip
 import discord
 from discord.ext import commands
 # internal
+from . import loudness
+from .audiocache import FrameCache
+from .mixer import PCMMixer
+from .playback import QueuedAudio
+
+# delays between connection attempts
+CONNECT_BACKOFF = (1.0, 2.0, 4.0)
+
+# one join per guild at a time, concurrent commands wait instead of reconnecting each
+_join_locks: dict[int, asyncio.Lock] = collections.defaultdict(asyncio.Lock)
+# one play_sound per guild at a time, from stopping the playing sound until the new one plays
+_play_locks: dict[int, asyncio.Lock] = collections.defaultdict(asyncio.Lock)
+# guild id -> perf_counter() of the last join, until its first packet was sent
+_pending_joins: dict[int, float] = {}
+# seconds from starting a join until the first audio packet was sent, most recent joins
+time_to_first_packet: collections.deque[float] = collections.deque(maxlen=100)
+# queue played per guild, if queueing is enabled
+_queues: dict[int, QueuedAudio] = {}
+# mixer played per guild, once a sound was layered
+_mixers: dict[int, PCMMixer] = {}
 
 
 async def is_joinable(ctx: discord.ApplicationContext) -> tuple[bool, str | None]:
@@ -23,28 +49,176 @@ async def is_joinable(ctx: discord.ApplicationContext) -> tuple[bool, str | None
 async def join_channel(ctx: commands.context, channel: discord.VoiceChannel):
     """
     Joins voice channel, handles switching if needed.
+    An existing connection of the guild is moved to the channel instead of connecting again.
     """
-
-    # if bot is already in a channel, disconnect
-    if ctx.voice_client is not None:
-        if ctx.voice_client.channel == channel:
+    async with _join_locks[channel.guild.id]:
+        voice_client: discord.VoiceClient | None = channel.guild.voice_client
+        if voice_client is not None and voice_client.is_connected():
+            if voice_client.channel == channel:
+                return
+            _pending_joins[channel.guild.id] = time.perf_counter()
+            await voice_client.move_to(channel)
             return
-        await ctx.voice_client.disconnect()
 
-    try:
-        await channel.connect()
-    except Exception as e:
-        await ctx.send("Failed to join your channel.")
-        logging.error(f"Failed to join channel {ctx.author.voice}: {e}")
-        raise e
+        # leftover of a broken connection
+        if voice_client is not None:
+            await voice_client.disconnect(force=True)
+
+        _pending_joins[channel.guild.id] = time.perf_counter()
+        for attempt, delay in enumerate((*CONNECT_BACKOFF, None)):
+            try:
+                await channel.connect()
+                return
+            except (asyncio.TimeoutError, discord.ClientException, discord.ConnectionClosed) as e:
+                if delay is None:
+                    _pending_joins.pop(channel.guild.id, None)
+                    await ctx.send("Failed to join your channel.")
+                    logging.error(f"Failed to join channel {channel}: {e}")
+                    raise e
+                logging.warning(f"Failed to join channel {channel} (attempt {attempt + 1}), retrying in {delay}s.")
+                if channel.guild.voice_client is not None:
+                    await channel.guild.voice_client.disconnect(force=True)
+                await asyncio.sleep(delay)
+
+
+def join_statistics() -> dict | None:
+    """
+    Returns {count,median,max} of time_to_first_packet in milliseconds, None without any joins.
+    """
+    if not time_to_first_packet:
+        return None
+    return {
+        "count": len(time_to_first_packet),
+        "median": statistics.median(time_to_first_packet) * 1000,
+        "max": max(time_to_first_packet) * 1000
+    }
+
+
+class FirstPacketTimer(discord.AudioSource):
+    """
+    Wraps an AudioSource and records the time from the guild's last join until its first packet.
+    """
+    def __init__(self, source: discord.AudioSource, guild_id: int):
+        self.source = source
+        self.guild_id = guild_id
+
+    def read(self) -> bytes:
+        data = self.source.read()
+        # called from the audio player thread, right before the packet is sent
+        if data and (started := _pending_joins.pop(self.guild_id, None)) is not None:
+            time_to_first_packet.append(time.perf_counter() - started)
+        return data
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
 
 
-async def play_sound(ctx: commands.context, sound):
+async def play_sound(
+        ctx: commands.context, sound, cached: pathlib.Path | None = None, gain: float | None = None,
+        queue_depth: int = 0, layer: bool = False
+):
     """
     Plays sound in current voice channel.
+    With a queue_depth the sound is queued if another one is playing, otherwise it replaces the playing one.
+    With layer the sound is mixed into the playing one.
+    Returns False if the queue is full or too many sounds are layered.
     """
-    if ctx.voice_client.is_playing():
-        ctx.voice_client.stop()
+    opener = functools.partial(open_source, ctx.bot, sound, cached, gain)
+    guild_id = ctx.voice_client.guild.id
+    # loading a sound yields to the event loop, a concurrent /play must not start playing or reset the queue meanwhile
+    async with _play_locks[guild_id]:
+        source = None
+        if layer and ctx.voice_client.is_playing():
+            source = await opener()
+            # /stop might have stopped the sound while loading, it is played on its own then
+            if ctx.voice_client is not None and ctx.voice_client.is_playing():
+                return await layer_sound(ctx, source)
+        elif queue_depth and ctx.voice_client.is_playing():
+            if (queue := _queues.get(guild_id)) is not None and not queue.finished:
+                queue.depth = queue_depth
+                return queue.add(opener)
 
+        # the playing sound continues while the new one is loaded
+        if source is None:
+            source = await opener()
+        # /stop might have disconnected while loading, the sound is dropped like a stopped one
+        if ctx.voice_client is None or not ctx.voice_client.is_connected():
+            source.cleanup()
+            return True
+        if ctx.voice_client.is_playing():
+            ctx.voice_client.stop()
+        _queues.pop(guild_id, None)
+        _mixers.pop(guild_id, None)
+
+        if queue_depth:
+            source = _queues[guild_id] = QueuedAudio(source, queue_depth)
+        play(ctx.bot, ctx.voice_client, source)
+        return True
+
+
+async def layer_sound(ctx: commands.context, source: discord.AudioSource) -> bool:
+    """
+    Mixes source into the playing sound, the playing source is moved into a mixer first.
+    Returns False if too many sounds are layered.
+    """
+    guild_id = ctx.voice_client.guild.id
+    if (mixer := _mixers.get(guild_id)) is None or mixer.finished:
+        mixer = PCMMixer([ctx.voice_client.source])
+        try:
+            ctx.voice_client.source = mixer
+        except ValueError:
+            # the player thread finished the sound right before
+            pass
+        # the playing sound might have ended in the meantime
+        if not ctx.voice_client.is_playing():
+            mixer.cleanup()
+            _mixers[guild_id] = PCMMixer([source])
+            play(ctx.bot, ctx.voice_client, _mixers[guild_id])
+            return True
+        _mixers[guild_id] = mixer
+    if not mixer.add(source):
+        source.cleanup()
+        return False
+    return True
+
+
+async def open_source(
+        bot: discord.Bot, sound, cached: pathlib.Path | None = None, gain: float | None = None
+) -> discord.AudioSource:
+    """
+    Returns an Opus AudioSource of sound.
+    If a pre-normalized opus version of the sound exists at cached, its frames are played from memory.
+    Otherwise the stored gain in dB is applied, sounds without one are normalized dynamically.
+    """
+    cache: FrameCache = bot.audio_cache
+    if cached is not None and cached.is_file():
+        # the first play reads the file into the cache, it stays there while being played regularly
+        source = await cache.load(cached)
+        return source or discord.FFmpegOpusAudio(str(cached), codec="opus")
+    # default sounds are cached at startup
+    if (source := cache.source(pathlib.Path(sound))) is not None:
+        return source
     # options is used for EBU R128
-    ctx.voice_client.play(discord.FFmpegOpusAudio(sound, options="-filter:a loudnorm"))
+    return discord.FFmpegOpusAudio(sound, options=f"-filter:a {loudness.audio_filter(gain)}")
+
+
+def play(bot: discord.Bot, voice_client: discord.VoiceClient, source: discord.AudioSource):
+    """
+    Plays source and dispatches the playback_start and playback_end events with the voice client.
+    """
+    loop = bot.loop
+
+    def after(error: Exception | None):
+        # called from the audio player thread
+        if error is not None:
+            logging.error(f"Playback in {voice_client.channel} failed: {error}")
+        loop.call_soon_threadsafe(bot.dispatch, "playback_end", voice_client)
+
+    # joins which weren't followed by a sound right away are not measured
+    if time.perf_counter() - _pending_joins.get(voice_client.guild.id, float('-inf')) < 30:
+        source = FirstPacketTimer(source, voice_client.guild.id)
+    voice_client.play(source, after=after)
+    bot.dispatch("playback_start", voice_client)
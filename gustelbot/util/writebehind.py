@@ -0,0 +1,98 @@
+# default
+import logging
+# pip
+from discord.ext import tasks
+# internal
+from .engine import Engine
+
+
+class UserWriteBehind:
+    """
+    Remembers which user names and display names are already stored in the database.
+    Only changed rows are written, buffered and flushed in batches every few seconds.
+    """
+    def __init__(self, engine: Engine):
+        self.logger = logging.getLogger(__name__)
+        self.engine = engine
+        # rows known to be in the database
+        self._names: dict[int, str] = {}
+        self._display_names: dict[tuple[int, int], str] = {}
+        # rows waiting to be written
+        self._pending_names: dict[int, str] = {}
+        self._pending_display_names: dict[tuple[int, int], str] = {}
+
+    def touch(self, user_id: int, name: str, server_id: int | None = None, display_name: str | None = None) -> bool:
+        """
+        Records a user as seen, returns True if anything has to be written.
+        """
+        changed = False
+        if self._names.get(user_id) != name:
+            self._pending_names[user_id] = name
+            changed = True
+        if server_id is not None and display_name is not None:
+            if self._display_names.get((user_id, server_id)) != display_name:
+                self._pending_display_names[(user_id, server_id)] = display_name
+                changed = True
+        return changed
+
+    async def ensure(
+            self, user_id: int, name: str, server_id: int | None = None, display_name: str | None = None
+    ):
+        """
+        Like touch(), but writes the user's pending rows right away in their own short transaction.
+        Needed before inserting rows which reference the user.
+        """
+        if not self.touch(user_id, name, server_id, display_name):
+            return
+        # taken out of the pending rows, so flush() doesn't wait on them while they are written here
+        names = {user_id: self._pending_names.pop(user_id)} if user_id in self._pending_names else {}
+        display_names = {
+            key: self._pending_display_names.pop(key) for key in list(self._pending_display_names) if key[0] == user_id
+        }
+        try:
+            await self.__write(names, display_names)
+        except Exception:
+            self.__requeue(names, display_names)
+            raise
+
+    @tasks.loop(seconds=5)
+    async def flush(self):
+        """
+        Writes all pending rows in one transaction.
+        """
+        if not self._pending_names and not self._pending_display_names:
+            return
+        names, self._pending_names = self._pending_names, {}
+        display_names, self._pending_display_names = self._pending_display_names, {}
+        try:
+            written = await self.__write(names, display_names)
+        except Exception:
+            self.logger.exception("Failed to write %s users, retrying later.", len(names) + len(display_names))
+            self.__requeue(names, display_names)
+            return
+        self.logger.debug("Flushed %s user names and %s display names.", len(names), written)
+
+    # -- "private" functions
+
+    async def __write(self, names: dict[int, str], display_names: dict[tuple[int, int], str]) -> int:
+        """
+        Writes the rows in one committed transaction and remembers them as stored, returns the written display names.
+        """
+        async with self.engine.connection() as db:
+            if names:
+                await db.user.add_users(list(names.items()))
+            written = []
+            if display_names:
+                written = await db.user.add_user_display_names(
+                    [(u, s, n) for (u, s), n in display_names.items()]
+                )
+        self._names.update(names)
+        # display names of unknown servers were skipped, they are retried once the user is seen again
+        for key in written:
+            self._display_names[tuple(key)] = display_names[tuple(key)]
+        return len(written)
+
+    def __requeue(self, names: dict[int, str], display_names: dict[tuple[int, int], str]):
+        # keep newer values which arrived in the meantime
+        self._pending_names = names | self._pending_names
+        self._pending_display_names = display_names | self._pending_display_names
@@ -0,0 +1,112 @@
+# default
+import os
+# pip
+import psycopg2.extensions
+import pytest
+# internal
+from gustelbot.util import config
+from gustelbot.util.database import Brotato
+from gustelbot.util.database import Database
+from gustelbot.util.database import FileCon
+
+# needs a postgres server, configured like the bot through the POSTGRES_* variables
+pytestmark = pytest.mark.skipif("POSTGRES_HOST" not in os.environ, reason="POSTGRES_HOST is not set")
+
+
+class ExplainCursor(psycopg2.extensions.cursor):
+    """
+    Explains every query before executing it, the plans are collected in plans.
+    """
+    plans: list[str] = []
+
+    def execute(self, query, params=None):
+        if query.lstrip().upper().startswith("SELECT"):
+            super().execute("EXPLAIN " + query, params)
+            ExplainCursor.plans.append("\n".join(x[0] for x in self.fetchall()))
+        return super().execute(query, params)
+
+
+@pytest.fixture
+def conn():
+    """
+    Connection with the schema applied in a separate postgres schema, which is dropped afterwards.
+    Sequential scans are disabled, so a query whose plan still has none can be answered by an index.
+    """
+    config.Config()
+    conn = Database.new_connection()
+    schema = f"gustelbot_index_test_{os.getpid()}"
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE SCHEMA {schema}")
+            cur.execute(f"SET search_path TO {schema}")
+        conn.commit()
+        Database.check(conn)
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO brotato_chars (name_de, name_en) VALUES ('Test', 'Test')")
+            cur.execute("SET LOCAL enable_seqscan = off")
+        ExplainCursor.plans = []
+        conn.cursor_factory = ExplainCursor
+        yield conn
+    finally:
+        conn.rollback()
+        conn.cursor_factory = psycopg2.extensions.cursor
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+def plan_of(conn, func, *args, **kwargs) -> str:
+    ExplainCursor.plans.clear()
+    func(conn, *args, **kwargs)
+    return "\n".join(ExplainCursor.plans)
+
+
+@pytest.mark.parametrize("kwargs, index", [
+    ({"file_hash": "abc"}, "files_file_hash_idx"),
+    ({"file_name": "ab/cd/abc.mp3"}, "files_file_name_idx"),
+    ({"display_name": "bruh", "deleted": False}, "files_visible_display_name_idx"),
+    ({"deleted": True}, "files_deleted_idx"),
+])
+def test_get_file_uses_index(conn, kwargs, index):
+    plan = plan_of(conn, FileCon.get_file, **kwargs)
+    assert index in plan
+    assert "Seq Scan on files" not in plan
+
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"after": ("bruh", 1)},
+    {"before": ("bruh", 1)},
+])
+def test_name_page_uses_index(conn, kwargs):
+    plan = plan_of(conn, FileCon.get_name_page, 21, **kwargs)
+    assert "files_visible_display_name_idx" in plan
+    # the order comes from the index
+    assert "Sort" not in plan
+
+
+def test_name_page_by_tag_uses_index(conn):
+    plan = plan_of(conn, FileCon.get_name_page, 21, tag="Meme")
+    assert "files_visible_display_name_idx" in plan
+    assert "tags_tag_name_lower_idx" in plan
+
+
+def test_brotato_char_uses_index(conn):
+    plan = plan_of(conn, Brotato.get_brotato_char, "test")
+    assert "brotato_chars_name_de_lower_idx" in plan
+    assert "brotato_chars_name_en_lower_idx" in plan
+
+
+@pytest.mark.parametrize("diff, character, index", [
+    (None, None, "brotato_runs_server_wave_idx"),
+    (None, "Test", "brotato_runs_server_char_wave_idx"),
+    (1, None, "brotato_runs_server_danger_wave_idx"),
+    (1, "Test", "brotato_runs_server_danger_char_wave_idx"),
+])
+def test_brotato_highscore_uses_index(conn, diff, character, index):
+    # the last query is the highscore itself, the ones before look up the character
+    ExplainCursor.plans.clear()
+    Brotato.get_brotato_highscore(conn, diff, character, 1)
+    assert index in ExplainCursor.plans[-1]
+    assert "Seq Scan on brotato_runs" not in ExplainCursor.plans[-1]
@@ -0,0 +1,100 @@
+# default
+import random
+from difflib import SequenceMatcher
+# pip
+# internal
+from gustelbot.util.search import SimilarityIndex
+
+
+def brute_force(names: dict[int, str], text: str, threshold: float) -> dict[int, float]:
+    """Ratio of every name reaching threshold, as the search did before the index"""
+    result = {}
+    for key, name in names.items():
+        if (ratio := SequenceMatcher(None, name.lower(), text.lower()).ratio()) >= threshold:
+            result[key] = ratio
+    return result
+
+
+def repeated_word_catalog(size: int = 3000) -> dict[int, str]:
+    """Names built from a few words, so many of them share most characters"""
+    rng = random.Random(7)
+    words = ["bruh", "moment", "meow", "bonk", "oof", "yeet", "sad", "violin", "air", "horn", "bro", "mom"]
+    names = {}
+    while len(names) < size:
+        name = " ".join(rng.choice(words) for _ in range(rng.randint(1, 3)))
+        if rng.random() < 0.3:
+            name += str(rng.randint(1, 99))
+        names[len(names)] = name
+    names[len(names)] = "bruh meow"
+    return names
+
+
+def build(names: dict[int, str]) -> SimilarityIndex:
+    index = SimilarityIndex()
+    for key, name in names.items():
+        index.add(key, name)
+    return index
+
+
+def test_search_matches_brute_force():
+    names = repeated_word_catalog()
+    index = build(names)
+    for text in ["bruh moment", "bruh", "meow", "air horn", "sad violin", "yeet bonk bro", "momnet", "xyz"]:
+        expected = brute_force(names, text, 0.65)
+        found = dict(index.search(text, 0.65, limit=len(names)))
+        assert found.keys() == expected.keys(), text
+        for key, ratio in found.items():
+            assert ratio == expected[key]
+
+
+def test_search_keeps_best_within_limit():
+    names = repeated_word_catalog()
+    index = build(names)
+    expected = sorted(brute_force(names, "bruh moment", 0.65).values(), reverse=True)[:32]
+    found = index.search("bruh moment", 0.65, limit=32)
+    assert [x[1] for x in found] == expected
+    assert len(found) == min(32, len(expected))
+
+
+def test_search_finds_match_among_many_similar_names():
+    # short names sharing most trigrams with the search used to crowd out the only real match
+    rng = random.Random(1)
+    names = {x: "bruh m" + "".join(rng.choice("xyzqwkjv") for _ in range(3)) for x in range(3000)}
+    names[3000] = "bruh meow"
+    found = build(names).search("bruh moment", 0.65)
+    assert dict(found) == brute_force(names, "bruh moment", 0.65)
+    assert 3000 in dict(found)
+
+
+def test_match_without_shared_trigrams():
+    index = build({1: "ya.b.c.d"})
+    assert [x[0] for x in index.search("abcd", 0.65)] == [1]
+
+
+def test_remove():
+    index = build({1: "bruh", 2: "bruh2"})
+    index.remove(1)
+    assert [x[0] for x in index.search("bruh", 0.65)] == [2]
+    assert len(index) == 1
+
+
+def test_search_matches_brute_force_at_any_threshold():
+    # the length and prefix filters depend on the threshold
+    names = repeated_word_catalog(1000)
+    index = build(names)
+    for key in range(0, 1000, 3):
+        index.remove(key)
+        del names[key]
+    for threshold in [0.3, 0.5, 0.8, 1.0]:
+        for text in ["bruh moment", "oof", "violin air horn"]:
+            found = dict(index.search(text, threshold, limit=len(names)))
+            assert found == brute_force(names, text, threshold), (text, threshold)
+
+
+def test_search_filters_before_limit():
+    names = repeated_word_catalog()
+    index = build(names)
+    expected = brute_force({x: y for x, y in names.items() if x % 5 == 0}, "bruh moment", 0.65)
+    found = index.search("bruh moment", 0.65, limit=3, accept=lambda x: x % 5 == 0)
+    assert [x[1] for x in found] == sorted(expected.values(), reverse=True)[:3]
+    assert all(x[0] % 5 == 0 for x in found)